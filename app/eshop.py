@@ -1,7 +1,29 @@
+import heapq
+import inspect
+import random
+import sys
+import threading
+import time
 import uuid
+from array import array
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from services.tracing import start_span
+
+STOCK_LOCK_STRIPES = 64
+_stock_locks = [threading.Lock() for _ in range(STOCK_LOCK_STRIPES)]
+
+
+def stock_lock(name):
+    """Return the lock guarding the stock of the product called ``name``."""
+    return _stock_locks[hash(name) % STOCK_LOCK_STRIPES]
+
 
 class Product:
+    # slots keep products small, and let the Inventory views below go without a __dict__
+    __slots__ = ('name', 'price', 'available_amount')
+
     def __init__(self, name, price, available_amount):
         self.name = name
         self.price = price
@@ -11,9 +33,21 @@ class Product:
         return self.available_amount >= requested_amount
 
     def buy(self, requested_amount):
-        if self.available_amount < requested_amount:
+        if not self.take(requested_amount):
             raise ValueError("Not enough stock available")
-        self.available_amount -= requested_amount
+
+    def take(self, requested_amount):
+        """Atomically decrease stock, returning False when not enough is available."""
+        with stock_lock(self.name):
+            if self.available_amount < requested_amount:
+                return False
+            self.available_amount -= requested_amount
+            return True
+
+    def restore(self, amount):
+        """Atomically give back stock taken with take()."""
+        with stock_lock(self.name):
+            self.available_amount += amount
 
     def __eq__(self, other):
         if isinstance(other, str):
@@ -32,18 +66,288 @@ class Product:
         return self.name
 
 
+class InventoryProduct(Product):
+    """Product view whose fields live in the columns of an Inventory."""
+
+    __slots__ = ('_inventory', '_position')
+
+    def __init__(self, inventory, position):  # pylint: disable=super-init-not-called
+        self._inventory = inventory
+        self._position = position
+
+    @property
+    def name(self):
+        return self._inventory.names[self._position]
+
+    @property
+    def price(self):
+        return self._inventory.prices[self._position]
+
+    @price.setter
+    def price(self, value):
+        self._inventory.prices[self._position] = value
+
+    @property
+    def available_amount(self):
+        return self._inventory.amounts[self._position]
+
+    @available_amount.setter
+    def available_amount(self, value):
+        self._inventory.amounts[self._position] = value
+
+
+class Inventory:
+    """Product catalog stored column-wise with O(1) lookup by name.
+
+    Names, prices and stock are kept in parallel arrays; indexing the
+    inventory returns a lightweight InventoryProduct view.
+    """
+
+    def __init__(self, products=()):
+        self.names = []
+        self.prices = array('d')
+        self.amounts = array('q')
+        self._positions = {}
+        for product in products:
+            self.add_product(product.name, product.price, product.available_amount)
+
+    def add_product(self, name, price, available_amount):
+        if name in self._positions:
+            raise ValueError(f"Product {name} already exists")
+
+        self._positions[name] = len(self.names)
+        self.names.append(name)
+        self.prices.append(price)
+        self.amounts.append(available_amount)
+        return self[name]
+
+    def get(self, name, default=None):
+        position = self._positions.get(name)
+        if position is None:
+            return default
+        return InventoryProduct(self, position)
+
+    def is_available(self, name, requested_amount):
+        return self.amounts[self._positions[name]] >= requested_amount
+
+    def memory_footprint(self):
+        return (
+            sys.getsizeof(self.names)
+            + sum(sys.getsizeof(name) for name in self.names)
+            + sys.getsizeof(self.prices)
+            + sys.getsizeof(self.amounts)
+            + sys.getsizeof(self._positions)
+        )
+
+    def __getitem__(self, name):
+        return InventoryProduct(self, self._positions[name])
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return (InventoryProduct(self, position) for position in range(len(self.names)))
+
+
+class ShardedStock:
+    """In-memory stock counter split across independently locked shards.
+
+    Buyers decrement a random shard, so concurrent checkouts of one hot
+    product rarely contend; when a shard cannot serve a request the shards
+    are rebalanced under all locks.
+    """
+
+    def __init__(self, available_amount, shards=8):
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._counts = [0] * shards
+        self.reset(available_amount)
+
+    @property
+    def total(self):
+        return sum(self._counts)
+
+    def reset(self, available_amount):
+        with self._all_locks():
+            self._counts = _spread(available_amount, len(self._counts))
+
+    def take(self, requested_amount):
+        shard = random.randrange(len(self._counts))
+        with self._locks[shard]:
+            if self._counts[shard] >= requested_amount:
+                self._counts[shard] -= requested_amount
+                return True
+
+        # the chosen shard ran dry: take across shards and spread what is left evenly again
+        with self._all_locks():
+            total = sum(self._counts)
+            if total < requested_amount:
+                return False
+            self._counts = _spread(total - requested_amount, len(self._counts))
+            return True
+
+    def restore(self, amount):
+        shard = random.randrange(len(self._counts))
+        with self._locks[shard]:
+            self._counts[shard] += amount
+
+    def _all_locks(self):
+        return _MultiLock(self._locks)
+
+
+def _spread(amount, shards):
+    base, extra = divmod(amount, shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+class _MultiLock:
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+class ShardedProduct(Product):
+    """Product whose stock lives in a sharded counter.
+
+    ``stock`` can be any object with ``total``, ``take`` and ``restore``,
+    e.g. ShardedStock or services.stock.DynamoShardedStock.
+    """
+
+    __slots__ = ('stock',)
+
+    # pylint: disable-next=super-init-not-called
+    def __init__(self, name, price, available_amount=0, shards=8, stock=None):
+        self.name = name
+        self.price = price
+        self.stock = stock if stock is not None else ShardedStock(available_amount, shards)
+
+    @property
+    def available_amount(self):
+        return self.stock.total
+
+    @available_amount.setter
+    def available_amount(self, value):
+        self.stock.reset(value)
+
+    def take(self, requested_amount):
+        return self.stock.take(requested_amount)
+
+    def restore(self, amount):
+        self.stock.restore(amount)
+
+
+class StockReservation:
+    """Stock held for an order until it is committed, released or expires."""
+
+    ACTIVE = 'active'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+
+    def __init__(self, items, expires_at=None):
+        self.items = dict(items)
+        self.expires_at = expires_at
+        self.state = self.ACTIVE
+        self._lock = threading.Lock()
+
+    def is_expired(self, now=None):
+        if self.expires_at is None:
+            return False
+        return (now if now is not None else time.monotonic()) >= self.expires_at
+
+    def commit(self):
+        if self.is_expired():
+            self.release()
+        with self._lock:
+            if self.state != self.ACTIVE:
+                raise ValueError(f"Reservation is {self.state}")
+            self.state = self.COMMITTED
+
+    def release(self):
+        with self._lock:
+            if self.state != self.ACTIVE:
+                return False
+            for product, amount in self.items.items():
+                product.restore(amount)
+            self.state = self.RELEASED
+            return True
+
+
+def reserve_stock(items, ttl=None):
+    """Take stock for every ``{product: amount}`` item or for none of them.
+
+    Each product is decremented under its own lock stripe, so carts that
+    share products never wait on a global lock; if one product runs short,
+    the stock already taken for the others is given back.
+    """
+    taken = []
+    for product, amount in items.items():
+        if not product.take(amount):
+            for taken_product, taken_amount in taken:
+                taken_product.restore(taken_amount)
+            raise ValueError("Not enough stock available")
+        taken.append((product, amount))
+
+    return StockReservation(items, time.monotonic() + ttl if ttl is not None else None)
+
+
+class StockReservations:
+    """Registry that hands out expiring reservations and releases stale ones."""
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._expiring = []
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def reserve(self, items, ttl=None):
+        reservation = reserve_stock(items, ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._counter += 1
+            heapq.heappush(self._expiring, (reservation.expires_at, self._counter, reservation))
+        return reservation
+
+    def release_expired(self, now=None):
+        now = now if now is not None else time.monotonic()
+        expired = []
+        with self._lock:
+            while self._expiring and self._expiring[0][0] <= now:
+                expired.append(heapq.heappop(self._expiring)[2])
+
+        return sum(1 for reservation in expired if reservation.release())
+
+
+def to_decimal(price):
+    """Convert a price to Decimal without picking up binary float noise."""
+    if isinstance(price, Decimal):
+        return price
+    return Decimal(str(price)) if isinstance(price, float) else Decimal(price)
+
+
 class ShoppingCart:
     def __init__(self):
         self.products = {}
+        self._by_name = {}
+        self._line_totals = {}
+        self._total = Decimal(0)
+        self.item_count = 0
 
     def contains_product(self, product):
         return product in self.products
 
+    def get_product(self, name):
+        return self._by_name.get(name)
+
     def get_total_price(self):
-        total = 0
-        for product, amount in self.products.items():
-            total += product.price * amount
-        return total
+        return self._total
 
     def calculate_total(self):
         return self.get_total_price()
@@ -51,63 +355,149 @@ class ShoppingCart:
     def add_product(self, product, amount):
         if not product.is_available(amount):
             raise ValueError(f"Product {product.name} has only {product.available_amount} items")
+        self._remove_line(product.name)
+
+        line_total = to_decimal(product.price) * amount
         self.products[product] = amount
+        self._by_name[product.name] = product
+        self._line_totals[product.name] = line_total
+        self._total += line_total
+        self.item_count += amount
 
     def remove_product(self, product):
-        if isinstance(product, str):
-            for p in list(self.products.keys()):
-                if p.name == product:
-                    del self.products[p]
-                    return
-        elif product in self.products:
-            del self.products[product]
+        self._remove_line(product if isinstance(product, str) else product.name)
+
+    def _remove_line(self, name):
+        product = self._by_name.pop(name, None)
+        if product is None:
+            return
+
+        self.item_count -= self.products.pop(product)
+        self._total -= self._line_totals.pop(name)
+
+    def clear(self):
+        self.products.clear()
+        self._by_name.clear()
+        self._line_totals.clear()
+        self._total = Decimal(0)
+        self.item_count = 0
 
     def submit_cart_order(self):
         if not self.products:
             raise ValueError("Cart is empty")
 
-        product_ids = []
-        for product, count in self.products.items():
-            if not product.is_available(count):
-                raise ValueError("Not enough stock available")
-            product.buy(count)
-            product_ids.append(str(product))
+        reserve_stock(self.products).commit()
+        product_ids = [str(product) for product in self.products]
 
-        self.products.copy()
-        self.products.clear()
+        self.clear()
         return product_ids
 
 
 class Order:
     def __init__(self, cart, shipping_service, order_id=None):
+        # an async service would take the stock and hand back a coroutine nobody awaits
+        if inspect.iscoroutinefunction(shipping_service.create_shipping):
+            raise TypeError("Order needs a synchronous shipping service")
         self.cart = cart
         self.shipping_service = shipping_service
         self.order_id = order_id if order_id else str(uuid.uuid4())
         self.status = "created"
 
     def place_order(self, shipping_type, due_date=None):
-        # Check for empty cart
-        if not self.cart.products:
-            raise ValueError("Cart is empty")
+        # The span is the root of the shipment's trace, carried through SQS to the consumer
+        with start_span("order.place_order", {"order_id": self.order_id}) as span:
+            # Check for empty cart
+            if not self.cart.products:
+                raise ValueError("Cart is empty")
 
-        # Set default due date if not provided
-        if not due_date:
-            due_date = datetime.now(timezone.utc) + timedelta(seconds=3)
+            # Set default due date if not provided
+            if not due_date:
+                due_date = datetime.now(timezone.utc) + timedelta(seconds=3)
 
-        # Validate due_date is in the future
-        if due_date <= datetime.now(timezone.utc):
-            raise ValueError("Due date must be in the future")
+            # Validate due_date is in the future
+            if due_date <= datetime.now(timezone.utc):
+                raise ValueError("Due date must be in the future")
 
-        # Get product_ids from cart
-        product_ids = self.cart.submit_cart_order()
+            # Get product_ids from cart
+            product_ids = self.cart.submit_cart_order()
 
-        # Create shipping
-        return self.shipping_service.create_shipping(shipping_type, product_ids, self.order_id, due_date)
+            # Create shipping
+            shipping_id = self.shipping_service.create_shipping(shipping_type, product_ids, self.order_id, due_date)
+            span.set_attribute("shipping_id", shipping_id)
+            return shipping_id
 
     def cancel_order(self):
         self.status = "cancelled"
 
 
+def place_orders(orders, shipping_type, due_date=None):
+    """Place many orders through one batched reservation and shipping pipeline.
+
+    Stock is reserved for every order up front; shipments are then created
+    with ShippingService.create_shippings (batch writes and batched sends).
+    Orders whose shipment fails get their stock back, and so does every
+    order of a batch whose create_shippings call raises; it only raises
+    before any message is sent, later failures are logged. Returns
+    ``(shipping_ids, errors)``: ids in order position and error messages
+    keyed by that position.
+    """
+    orders = list(orders)
+    shipping_ids = [None] * len(orders)
+    errors = {}
+
+    if not due_date:
+        due_date = datetime.now(timezone.utc) + timedelta(seconds=3)
+    if due_date <= datetime.now(timezone.utc):
+        raise ValueError("Due date must be in the future")
+
+    batches = {}
+    for index, order in enumerate(orders):
+        if not order.cart.products:
+            errors[index] = "Cart is empty"
+            continue
+        if shipping_type not in order.shipping_service.list_available_shipping_type():
+            errors[index] = "Shipping type is not available"
+            continue
+
+        try:
+            reservation = reserve_stock(order.cart.products)
+        except ValueError as error:
+            errors[index] = str(error)
+            continue
+
+        batch = batches.setdefault(id(order.shipping_service), (order.shipping_service, []))
+        batch[1].append((index, reservation))
+
+    for shipping_service, reserved in batches.values():
+        try:
+            created_ids, create_errors = shipping_service.create_shippings([
+                {
+                    'shipping_type': shipping_type,
+                    'product_ids': [str(product) for product in orders[index].cart.products],
+                    'order_id': orders[index].order_id,
+                    'due_date': due_date,
+                }
+                for index, _ in reserved
+            ])
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            for index, reservation in reserved:
+                reservation.release()
+                errors[index] = str(error)
+            continue
+
+        for position, (index, reservation) in enumerate(reserved):
+            if position in create_errors:
+                reservation.release()
+                errors[index] = create_errors[position]
+                continue
+
+            reservation.commit()
+            orders[index].cart.clear()
+            shipping_ids[index] = created_ids[position]
+
+    return shipping_ids, errors
+
+
 class ShippingService:
     SHIPPING_CREATED = 'created'
     SHIPPING_IN_PROGRESS = 'in_progress'
@@ -0,0 +1,96 @@
+"""Vectorized pricing of many carts at once.
+
+Cart lines are flattened into columns (cart index, product name, unit
+price, quantity) and priced with NumPy in integer cents, so results are
+exact and match ``ShoppingCart.get_total_price``. Prices that are not a
+whole number of cents are rejected rather than rounded.
+"""
+from decimal import Decimal
+
+import numpy as np
+
+from app.eshop import to_decimal
+
+CENTS = 100
+
+
+class CartLines:
+    """Columnar table of cart lines, sorted by cart index."""
+
+    def __init__(self, cart_index, names, prices, quantities, cart_count=None):
+        codes = {}
+        sku_codes = np.fromiter(
+            (codes.setdefault(name, len(codes)) for name in names), dtype=np.int64
+        )
+        cart_index = np.asarray(cart_index, dtype=np.int64)
+        order = np.argsort(cart_index, kind="stable")
+        self.cart_index = cart_index[order]
+        self.skus = list(codes)
+        self.sku_codes = sku_codes[order]
+        self.price_cents = to_cents(prices)[order]
+        self.quantities = np.asarray(quantities, dtype=np.int64)[order]
+        if cart_count is None:
+            cart_count = int(self.cart_index.max(initial=-1)) + 1
+        self.cart_count = cart_count
+
+    @classmethod
+    def from_carts(cls, carts):
+        """Flatten ShoppingCart objects into a CartLines table."""
+        cart_index = []
+        names = []
+        prices = []
+        quantities = []
+        for index, cart in enumerate(carts):
+            for product, amount in cart.products.items():
+                cart_index.append(index)
+                names.append(product.name)
+                prices.append(product.price)
+                quantities.append(amount)
+
+        return cls(cart_index, names, prices, quantities, cart_count=len(carts))
+
+    def __len__(self):
+        return len(self.cart_index)
+
+
+def to_cents(prices):
+    """Convert prices to whole cents as an int64 array.
+
+    Every distinct price is checked on its decimal value, read the way
+    ``to_decimal`` reads it, and a ValueError is raised for sub-cent prices.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    for price in np.unique(prices):
+        if to_decimal(float(price)) * CENTS % 1:
+            raise ValueError(f"Price {float(price)} is not a whole number of cents")
+    return np.rint(prices * CENTS).astype(np.int64)
+
+
+def apply_overrides(lines, overrides):
+    """Return unit prices in cents with ``{name: price}`` overrides applied."""
+    if not overrides or len(lines) == 0:
+        return lines.price_cents
+
+    # look each distinct SKU up once, then broadcast back to the lines
+    has_override = np.fromiter(
+        (name in overrides for name in lines.skus), dtype=bool, count=len(lines.skus)
+    )
+    override_cents = to_cents([overrides.get(name, 0) for name in lines.skus])
+    codes = lines.sku_codes
+    return np.where(has_override[codes], override_cents[codes], lines.price_cents)
+
+
+def price_lines(lines, overrides=None):
+    """Return the total of every cart in cents as an int64 array."""
+    line_totals = apply_overrides(lines, overrides) * lines.quantities
+    running = np.concatenate(([0], np.cumsum(line_totals)))
+    carts = np.arange(lines.cart_count)
+    starts = np.searchsorted(lines.cart_index, carts, side="left")
+    ends = np.searchsorted(lines.cart_index, carts, side="right")
+    return running[ends] - running[starts]
+
+
+def price_carts(carts, overrides=None):
+    """Return cart totals as Decimals, in the order of ``carts``."""
+    totals = price_lines(CartLines.from_carts(carts), overrides)
+    return [Decimal(int(total)).scaleb(-2) for total in totals]
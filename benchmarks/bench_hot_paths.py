@@ -0,0 +1,163 @@
+"""Benchmark the checkout and shipping hot paths.
+
+Run with ``python -m benchmarks.bench_hot_paths``. ``--backend memory``
+(the default) uses the in-process stand-ins from services.memory;
+``--backend localstack`` talks to the docker-compose LocalStack and
+creates the shipping table and queue when they are missing. Save a
+baseline with ``--save baseline.json`` and check a later run against it
+with ``--compare baseline.json``; the run exits with status 1 when any
+benchmark regressed by more than ``--tolerance``. Messages published by
+the benchmarks are consumed or deleted, so nothing is left in the queue.
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+from app.eshop import Order, Product, ShoppingCart
+from services.consumer import ShippingConsumer
+from services.service import ShippingService
+from benchmarks.harness import compare, load_baseline, measure, report, save_baseline
+
+CART_SIZES = (10, 100, 1000)
+# one receive returns at most 10 messages
+BATCH_SIZES = (1, 5, 10)
+
+
+def memory_backend():
+    from services.memory import MemoryQueue, MemoryShippingPublisher, MemoryShippingRepository, MemoryTable
+
+    return MemoryShippingRepository(MemoryTable()), MemoryShippingPublisher(MemoryQueue())
+
+
+def localstack_backend():
+    from botocore.exceptions import ClientError  # type: ignore
+
+    from services.config import SHIPPING_TABLE_NAME
+    from services.db import get_dynamodb_resource
+    from services.publisher import ShippingPublisher
+    from services.repository import ShippingRepository
+
+    client = get_dynamodb_resource().meta.client
+    try:
+        client.describe_table(TableName=SHIPPING_TABLE_NAME)
+    except ClientError:
+        # the measured paths only use the primary key, the secondary indexes are not needed
+        client.create_table(
+            TableName=SHIPPING_TABLE_NAME,
+            KeySchema=[{"AttributeName": "shipping_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "shipping_id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        client.get_waiter("table_exists").wait(TableName=SHIPPING_TABLE_NAME)
+    return ShippingRepository(), ShippingPublisher()
+
+
+BACKENDS = {"memory": memory_backend, "localstack": localstack_backend}
+
+
+def build_catalog(size, seed=0):
+    rng = random.Random(seed)
+    return [Product(f"SKU-{index}", rng.randint(100, 100000) / 100, 10 ** 9) for index in range(size)]
+
+
+def filled_cart(catalog, size):
+    cart = ShoppingCart()
+    for product in catalog[:size]:
+        cart.add_product(product, 1)
+    return cart
+
+
+def cart_benchmarks(iterations):
+    catalog = build_catalog(max(CART_SIZES) + 1)
+    extra = catalog[-1]
+    results = []
+    for size in CART_SIZES:
+        cart = filled_cart(catalog, size)
+        # re-adding the same line keeps the cart at its size
+        results.append(measure(f"cart.add_product[{size}]", lambda: cart.add_product(extra, 2), iterations))
+        results.append(measure(f"cart.get_total_price[{size}]", cart.get_total_price, iterations))
+    return results
+
+
+def drain(publisher):
+    # deletes every visible message, such as the ones left by the creation benchmarks or an earlier run
+    while True:
+        messages = publisher.receive_shippings(10, wait_time=0)
+        if not messages:
+            return
+        publisher.delete_shippings([message["ReceiptHandle"] for message in messages])
+
+
+def shipping_benchmarks(repository, publisher, iterations):
+    service = ShippingService(repository, publisher)
+    consumer = ShippingConsumer(service, publisher)
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    catalog = build_catalog(10)
+
+    def new_order():
+        return (Order(filled_cart(catalog, len(catalog)), service),)
+
+    def queued_shippings(count):
+        def setup():
+            service.create_shippings([
+                {"shipping_type": shipping_type, "product_ids": ["SKU-1", "SKU-2"], "order_id": "bench",
+                 "due_date": due_date}
+                for _ in range(count)
+            ])
+            return (count,)
+        return setup
+
+    def consume(count):
+        # the consumer's path: receive, process the batch and delete the handled messages
+        messages = []
+        while len(messages) < count:
+            messages += publisher.receive_shippings(count - len(messages), wait_time=1)
+        consumer.handle(messages)
+
+    drain(publisher)
+    results = [
+        measure("order.place_order", lambda order: order.place_order(shipping_type, due_date), iterations,
+                setup=new_order),
+        measure("service.create_shipping",
+                lambda: service.create_shipping(shipping_type, ["SKU-1", "SKU-2"], "bench", due_date), iterations),
+    ]
+    drain(publisher)
+    for size in BATCH_SIZES:
+        results.append(measure(f"consumer.receive_process_delete[{size}]", consume, iterations,
+                               setup=queued_shippings(size), items=size))
+    drain(publisher)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="memory")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail when results regressed against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    repository, publisher = BACKENDS[args.backend]()
+    results = cart_benchmarks(args.iterations) + shipping_benchmarks(repository, publisher, args.iterations)
+    report(results)
+
+    if args.save:
+        save_baseline(args.save, results, backend=args.backend, iterations=args.iterations)
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        if baseline.get("backend") != args.backend:
+            print(f"Baseline was recorded on the {baseline.get('backend')} backend, not {args.backend}")
+            return 2
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Compare per-cart repricing in a Python loop with app.pricing.
+
+Run with ``python -m benchmarks.bench_pricing``.
+"""
+import argparse
+import random
+import time
+
+from app.eshop import Product, ShoppingCart, to_decimal
+from app.pricing import CartLines, price_carts, price_lines
+
+
+def build_carts(cart_count, lines_per_cart, catalog_size, seed=0):
+    rng = random.Random(seed)
+    catalog = [Product(f"SKU-{index}", rng.randint(100, 100000) / 100, 10 ** 9) for index in range(catalog_size)]
+    carts = []
+    for _ in range(cart_count):
+        cart = ShoppingCart()
+        for product in rng.sample(catalog, lines_per_cart):
+            cart.add_product(product, rng.randint(1, 5))
+        carts.append(cart)
+    return catalog, carts
+
+
+def reprice_loop(carts, overrides):
+    return [
+        sum((to_decimal(overrides.get(product.name, product.price)) * amount
+             for product, amount in cart.products.items()), to_decimal(0))
+        for cart in carts
+    ]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--carts", type=int, default=10000)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--catalog", type=int, default=5000)
+    args = parser.parse_args()
+
+    catalog, carts = build_carts(args.carts, args.lines, args.catalog)
+    overrides = {product.name: round(product.price * 0.9, 2) for product in catalog[::10]}
+
+    expected, loop_seconds = timed(reprice_loop, carts, overrides)
+    actual, batch_seconds = timed(price_carts, carts, overrides)
+    lines, flatten_seconds = timed(CartLines.from_carts, carts)
+    _, columns_seconds = timed(price_lines, lines, overrides)
+
+    assert actual == expected, "Vectorized totals differ from the per-cart loop"
+    print(f"{args.carts} carts x {args.lines} lines, {len(overrides)} overrides")
+    print(f"per-cart loop:          {loop_seconds * 1000:9.1f} ms")
+    print(f"price_carts:            {batch_seconds * 1000:9.1f} ms ({loop_seconds / batch_seconds:.1f}x)")
+    print(f"  flatten to CartLines: {flatten_seconds * 1000:9.1f} ms")
+    print(f"  price_lines:          {columns_seconds * 1000:9.1f} ms ({loop_seconds / columns_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Timing, reporting and baseline comparison shared by the benchmarks."""
+import json
+import math
+import platform
+import time
+
+
+def percentile(samples, q):
+    """Return the q-th percentile (0-100) of sorted samples, nearest rank."""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+def measure(name, function, iterations, setup=None, warmup=3, items=1):
+    """Time ``iterations`` calls of ``function`` and summarize them.
+
+    ``setup`` is called untimed before every call and its result is passed
+    to ``function``; ``items`` is how many units of work one call does, for
+    the items-per-second figure of batch operations.
+    """
+    for _ in range(warmup):
+        function(*(setup() if setup else ()))
+
+    samples = []
+    for _ in range(iterations):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+
+    samples.sort()
+    total = sum(samples)
+    return {
+        "name": name,
+        "iterations": iterations,
+        "ops_per_second": iterations / total if total else math.inf,
+        "items_per_second": iterations * items / total if total else math.inf,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def report(results):
+    print(f"{'benchmark':<40} {'ops/s':>12} {'items/s':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        print(f"{result['name']:<40} {result['ops_per_second']:>12.1f} {result['items_per_second']:>12.1f} "
+              f"{result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f}")
+
+
+def save_baseline(path, results, **meta):
+    baseline = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        **meta,
+        "results": {result["name"]: result for result in results},
+    }
+    with open(path, "w") as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return messages for every benchmark that regressed by more than ``tolerance``.
+
+    A benchmark regresses when its p50 or p95 latency grew, or its
+    throughput dropped, by more than that fraction of the baseline.
+    Benchmarks missing from the baseline are not compared.
+    """
+    regressions = []
+    for result in results:
+        base = baseline["results"].get(result["name"])
+        if base is None:
+            continue
+
+        for key in ("p50_ms", "p95_ms"):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{result['name']}: {key} {base[key]:.3f} -> {result[key]:.3f}")
+        if result["ops_per_second"] < base["ops_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{result['name']}: ops/s {base['ops_per_second']:.1f} -> {result['ops_per_second']:.1f}"
+            )
+
+    return regressions
@@ -1 +1 @@
-from .service import ShippingService
\ No newline at end of file
+from .service import ShippingService, AsyncShippingService
@@ -0,0 +1,27 @@
+from .config import SHIPPING_BACKEND
+
+BACKENDS = ("dynamodb", "memory")
+
+
+def create_repository(backend: str = SHIPPING_BACKEND):
+    """Return the shipping repository of the configured backend."""
+    if backend == "dynamodb":
+        from .repository import ShippingRepository
+        return ShippingRepository()
+    if backend == "memory":
+        from .memory import MemoryShippingRepository
+        return MemoryShippingRepository()
+
+    raise ValueError(f"Unknown shipping backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def create_publisher(backend: str = SHIPPING_BACKEND):
+    """Return the shipping publisher of the configured backend."""
+    if backend == "dynamodb":
+        from .publisher import ShippingPublisher
+        return ShippingPublisher()
+    if backend == "memory":
+        from .memory import MemoryShippingPublisher
+        return MemoryShippingPublisher()
+
+    raise ValueError(f"Unknown shipping backend {backend!r}, expected one of {', '.join(BACKENDS)}")
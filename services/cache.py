@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .config import SHIPPING_CACHE_MAX_SIZE, SHIPPING_CACHE_TTL_SECONDS
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire ``ttl`` seconds after being written."""
+
+    def __init__(self, max_size: int = SHIPPING_CACHE_MAX_SIZE, ttl: float = SHIPPING_CACHE_TTL_SECONDS,
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None, accept=None):
+        # accept(value) can reject a live entry, which then counts as a miss
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            if accept is not None and not accept(entry[1]):
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, key, function):
+        # replaces a live entry with function(value) and returns it; does not count as a hit or miss
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                return None
+
+            value = function(entry[1])
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
+
+
+class CachedShippingRepository:
+    """Read-through cache in front of a ShippingRepository.
+
+    Entries are ``(item, complete)`` pairs: projected reads cache the
+    attributes they fetched and only full reads mark an item complete.
+    Status updates made through this object are written through to the
+    cache; updates made elsewhere become visible once the entry expires.
+    """
+
+    def __init__(self, repository, cache: TTLCache = None):
+        self.repository = repository
+        self.cache = cache if cache is not None else TTLCache()
+
+    def __getattr__(self, name):
+        return getattr(self.repository, name)
+
+    def get_shipping(self, shipping_id, attributes: list = None, consistent: bool = False):
+        # consistent reads always go to the table and refresh the entry
+        entry = None if consistent else self.cache.get(shipping_id, accept=self._covers(attributes))
+        if entry is not None:
+            return dict(entry[0])
+
+        shipping = self.repository.get_shipping(shipping_id, attributes=attributes, consistent=consistent)
+        if shipping is None:
+            return None
+        return dict(self._store(shipping_id, shipping, complete=not attributes))
+
+    def get_shipping_batch(self, shipping_ids: list, attributes: list = None, consistent: bool = False):
+        shippings = {}
+        missing = []
+        for shipping_id in dict.fromkeys(shipping_ids):
+            entry = None if consistent else self.cache.get(shipping_id, accept=self._covers(attributes))
+            if entry is None:
+                missing.append(shipping_id)
+            else:
+                shippings[shipping_id] = dict(entry[0])
+
+        if missing:
+            fetched = self.repository.get_shipping_batch(missing, attributes=attributes, consistent=consistent)
+            for shipping_id, shipping in fetched.items():
+                shippings[shipping_id] = dict(self._store(shipping_id, shipping, complete=not attributes))
+
+        return shippings
+
+    def create_shipping(self, *args, **kwargs):
+        shipping_id = self.repository.create_shipping(*args, **kwargs)
+        self.cache.invalidate(shipping_id)
+        return shipping_id
+
+    def update_shipping_status(self, shipping_id, status):
+        try:
+            response = self.repository.update_shipping_status(shipping_id, status)
+        except Exception:
+            self.cache.invalidate(shipping_id)
+            raise
+
+        self._write_status(shipping_id, status)
+        return response
+
+    def update_shipping_status_batch(self, statuses: dict, expected_status: str = None):
+        responses, errors = self.repository.update_shipping_status_batch(statuses, expected_status=expected_status)
+        for shipping_id in responses:
+            self._write_status(shipping_id, statuses[shipping_id])
+        for shipping_id in errors:
+            self.cache.invalidate(shipping_id)
+
+        return responses, errors
+
+    def _store(self, shipping_id, shipping, complete):
+        entry = self.cache.update(shipping_id, lambda cached: ({**cached[0], **shipping}, cached[1] or complete))
+        if entry is None:
+            entry = (shipping, complete)
+            self.cache.set(shipping_id, entry)
+        return entry[0]
+
+    @staticmethod
+    def _covers(attributes):
+        if not attributes:
+            return lambda entry: entry[1]
+        return lambda entry: all(attribute in entry[0] for attribute in attributes)
+
+    def _write_status(self, shipping_id, status):
+        self.cache.update(shipping_id, lambda entry: ({**entry[0], 'shipping_status': status}, entry[1]))
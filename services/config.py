@@ -4,3 +4,39 @@ AWS_ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL", "http://localhost:4566")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 SHIPPING_TABLE_NAME = os.getenv("SHIPPING_TABLE_NAME", "ShippingTable")
 SHIPPING_QUEUE = os.getenv("SHIPPING_QUEUE_NAME", "ShippingQueue")
+PUBLISHER_MAX_LINGER_SECONDS = float(os.getenv("PUBLISHER_MAX_LINGER_SECONDS", "0.05"))
+SHIPPING_OUTBOX_INDEX = os.getenv("SHIPPING_OUTBOX_INDEX_NAME", "OutboxIndex")
+OUTBOX_RELAY_INTERVAL_SECONDS = float(os.getenv("OUTBOX_RELAY_INTERVAL_SECONDS", "0.5"))
+CONSUMER_WAIT_TIME_SECONDS = int(os.getenv("CONSUMER_WAIT_TIME_SECONDS", "10"))
+CONSUMER_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("CONSUMER_VISIBILITY_TIMEOUT_SECONDS", "30"))
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50"))
+AWS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("AWS_CONNECT_TIMEOUT_SECONDS", "2"))
+AWS_READ_TIMEOUT_SECONDS = float(os.getenv("AWS_READ_TIMEOUT_SECONDS", "30"))
+AWS_TCP_KEEPALIVE = os.getenv("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+SHIPPING_CACHE_MAX_SIZE = int(os.getenv("SHIPPING_CACHE_MAX_SIZE", "10000"))
+SHIPPING_CACHE_TTL_SECONDS = float(os.getenv("SHIPPING_CACHE_TTL_SECONDS", "5"))
+STOCK_TABLE_NAME = os.getenv("STOCK_TABLE_NAME", "StockTable")
+STOCK_SHARDS = int(os.getenv("STOCK_SHARDS", "8"))
+SHIPPING_STATUS_DUE_INDEX = os.getenv("SHIPPING_STATUS_DUE_INDEX_NAME", "StatusDueIndex")
+SWEEPER_HORIZON_SECONDS = float(os.getenv("SWEEPER_HORIZON_SECONDS", "60"))
+SHIPPING_ORDER_INDEX = os.getenv("SHIPPING_ORDER_INDEX_NAME", "OrderIndex")
+EXPORT_SEGMENTS = int(os.getenv("EXPORT_SEGMENTS", "4"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+PRODUCT_IDS_LIST_MAX_BYTES = int(os.getenv("PRODUCT_IDS_LIST_MAX_BYTES", "1024"))
+PRODUCT_IDS_CHUNK_BYTES = int(os.getenv("PRODUCT_IDS_CHUNK_BYTES", str(300 * 1024)))
+SHIPPING_BACKEND = os.getenv("SHIPPING_BACKEND", "dynamodb")
+MEMORY_BACKEND_LATENCY_SECONDS = float(os.getenv("MEMORY_BACKEND_LATENCY_SECONDS", "0"))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_CONSUMED_CAPACITY = os.getenv("METRICS_CONSUMED_CAPACITY", "true").lower() == "true"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "standard")
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "3"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("BACKOFF_BASE_SECONDS", "0.05"))
+BACKOFF_MAX_SECONDS = float(os.getenv("BACKOFF_MAX_SECONDS", "2"))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_INITIAL_RPS = float(os.getenv("RATE_LIMIT_INITIAL_RPS", "1000"))
+RATE_LIMIT_MIN_RPS = float(os.getenv("RATE_LIMIT_MIN_RPS", "10"))
+RATE_LIMIT_MAX_RPS = float(os.getenv("RATE_LIMIT_MAX_RPS", "4000"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "200"))
+RATE_LIMIT_INCREASE_RPS = float(os.getenv("RATE_LIMIT_INCREASE_RPS", "10"))
@@ -0,0 +1,142 @@
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import CONSUMER_WAIT_TIME_SECONDS, CONSUMER_VISIBILITY_TIMEOUT_SECONDS
+from .retry import backoff_delay
+from .tracing import message_context, record_span
+
+# consecutive receive failures after which the backoff stops growing
+MAX_BACKOFF_ATTEMPT = 10
+
+logger = logging.getLogger(__name__)
+
+
+class ShippingConsumer:
+    """Long-running loop around ``ShippingService.process_shipping_batch``.
+
+    The next receive is prefetched while the current batch is processed,
+    handled messages are deleted with delete_message_batch, and the
+    visibility of in-flight messages is extended from the moment they are
+    received, prefetched ones included, until their batch is done.
+    Failed receives are logged and retried with backoff, so a transient
+    error does not stop the worker.
+    """
+
+    def __init__(self, service, publisher, batch_size: int = 10,
+                 wait_time: int = CONSUMER_WAIT_TIME_SECONDS,
+                 visibility_timeout: int = CONSUMER_VISIBILITY_TIMEOUT_SECONDS):
+        self.service = service
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self._stop = threading.Event()
+
+    def run(self):
+        self._stop.clear()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="shipping-prefetch") as prefetch:
+            next_batch = prefetch.submit(self._receive)
+            failures = 0
+            while next_batch is not None:
+                try:
+                    messages, heartbeat = next_batch.result()
+                    failures = 0
+                except Exception:
+                    logger.exception("Failed to receive shippings, retrying")
+                    messages, heartbeat = [], None
+                    self._stop.wait(backoff_delay(failures))
+                    failures = min(failures + 1, MAX_BACKOFF_ATTEMPT)
+                # after stop() the prefetched batch is still drained, but nothing new is received
+                next_batch = None if self._stop.is_set() else prefetch.submit(self._receive)
+                if messages:
+                    self.handle(messages, heartbeat)
+
+    def stop(self):
+        self._stop.set()
+
+    def handle(self, messages: list, heartbeat=None):
+        # heartbeat: the one _receive started for these messages, or None to start it here
+        parents = self._record_dwell(messages)
+        if heartbeat is None:
+            heartbeat = self._start_heartbeat(messages)
+        try:
+            results = self.service.process_shipping_batch([message['Body'] for message in messages], parents=parents)
+        except Exception:
+            logger.exception("Failed to process %d shippings, they will be redelivered", len(messages))
+            return []
+        finally:
+            done, thread = heartbeat
+            done.set()
+            thread.join()
+
+        handled = [
+            (message['ReceiptHandle'], message['Body']) for message, result in zip(messages, results)
+            if result is not None
+        ]
+        if handled:
+            self._delete(handled)
+        return results
+
+    def _delete(self, handled: list):
+        # handled: (receipt handle, shipping id) pairs; shippings left in the queue are processed again
+        try:
+            errors = self.publisher.delete_shippings([receipt_handle for receipt_handle, _ in handled])
+        except Exception:
+            logger.exception("Failed to delete %d handled shippings, they will be redelivered", len(handled))
+            return
+
+        for index, error in errors.items():
+            logger.warning("Failed to delete handled shipping %s, it will be redelivered: %s", handled[index][1], error)
+
+    @staticmethod
+    def _record_dwell(messages: list):
+        # resumes the trace of every message with a span for the time it waited in the queue
+        received = time.time()
+        parents = []
+        for message in messages:
+            parent = message_context(message)
+            sent = message.get('Attributes', {}).get('SentTimestamp')
+            if sent is not None:
+                record_span("shipping.queue", parent, int(sent) / 1000, received, {"shipping_id": message['Body']})
+            parents.append(parent)
+        return parents
+
+    def _receive(self):
+        # a prefetched batch may wait longer than visibility_timeout for the current one to finish
+        messages = self.publisher.receive_shippings(
+            self.batch_size, wait_time=self.wait_time, visibility_timeout=self.visibility_timeout
+        )
+        return messages, self._start_heartbeat(messages) if messages else None
+
+    def _start_heartbeat(self, messages: list):
+        done = threading.Event()
+        receipt_handles = [message['ReceiptHandle'] for message in messages]
+        thread = threading.Thread(target=self._extend_visibility, args=(receipt_handles, done), daemon=True)
+        thread.start()
+        return done, thread
+
+    def _extend_visibility(self, receipt_handles: list, done: threading.Event):
+        while not done.wait(self.visibility_timeout / 2):
+            try:
+                self.publisher.extend_visibility(receipt_handles, self.visibility_timeout)
+            except Exception:
+                logger.exception("Failed to extend visibility of %d shippings", len(receipt_handles))
+
+
+def main():
+    from .backends import create_publisher, create_repository
+    from .service import ShippingService
+
+    logging.basicConfig(level=logging.INFO)
+    publisher = create_publisher()
+    consumer = ShippingConsumer(ShippingService(create_repository(), publisher), publisher)
+    signal.signal(signal.SIGTERM, lambda *_: consumer.stop())
+    signal.signal(signal.SIGINT, lambda *_: consumer.stop())
+    consumer.run()
+
+
+if __name__ == "__main__":
+    main()
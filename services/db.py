@@ -1,9 +1,128 @@
+import functools
+import threading
+
 import boto3 # type: ignore
-from .config import AWS_ENDPOINT_URL, AWS_REGION
+from botocore.config import Config  # type: ignore
 
-def get_dynamodb_resource():
-    return boto3.resource(
+from .config import (
+    AWS_ENDPOINT_URL, AWS_REGION, AWS_MAX_POOL_CONNECTIONS, AWS_CONNECT_TIMEOUT_SECONDS,
+    AWS_READ_TIMEOUT_SECONDS, AWS_TCP_KEEPALIVE, METRICS_ENABLED, AWS_RETRY_MODE, AWS_MAX_ATTEMPTS,
+    RATE_LIMIT_ENABLED
+)
+from .metrics import instrument
+from .retry import install_rate_limiting
+
+# Clients are built once per process and shared; botocore clients are thread-safe and keep their own
+# connection pool. boto3 resources are not thread-safe, so those are built per thread on a shared client.
+_lock = threading.RLock()
+
+
+def _once(factory):
+    cached = functools.lru_cache(maxsize=None)(factory)
+
+    @functools.wraps(factory)
+    def wrapper(*args):
+        with _lock:
+            return cached(*args)
+
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
+def get_client_config():
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=AWS_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=AWS_READ_TIMEOUT_SECONDS,
+        tcp_keepalive=AWS_TCP_KEEPALIVE,
+        retries={"mode": AWS_RETRY_MODE, "max_attempts": AWS_MAX_ATTEMPTS},
+    )
+
+
+@_once
+def get_session():
+    session = boto3.session.Session(region_name=AWS_REGION)
+    if METRICS_ENABLED:
+        # handlers must be registered before clients are created, they copy the session's emitter
+        instrument(session.events)
+    if RATE_LIMIT_ENABLED:
+        install_rate_limiting(session.events)
+    return session
+
+
+@_once
+def _get_dynamodb_resource_factory():
+    # the client of the first resource becomes the shared one, its class builds the other resources on it
+    resource = get_session().resource(
         "dynamodb",
         endpoint_url=AWS_ENDPOINT_URL,
-        region_name=AWS_REGION
+        region_name=AWS_REGION,
+        config=get_client_config()
+    )
+    return type(resource), resource.meta.client
+
+
+def get_dynamodb_resource():
+    """Return a new DynamoDB resource on the process-wide client."""
+    resource_class, client = _get_dynamodb_resource_factory()
+    return resource_class(client=client)
+
+
+class LocalTable:
+    """Lazily builds one boto3 Table per thread, all of them on the shared DynamoDB client."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._local = threading.local()
+
+    def get(self):
+        table = getattr(self._local, "table", None)
+        if table is None:
+            table = self._local.table = get_dynamodb_resource().Table(self.name)
+        return table
+
+
+@_once
+def get_sqs_client():
+    return get_session().client(
+        "sqs",
+        endpoint_url=AWS_ENDPOINT_URL,
+        region_name=AWS_REGION,
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        config=get_client_config()
     )
+
+
+@_once
+def get_queue_url(queue_name):
+    return get_sqs_client().create_queue(QueueName=queue_name)["QueueUrl"]
+
+
+def get_aio_client(service_name, **kwargs):
+    # aiobotocore is only needed by the async repository and publisher
+    from aiobotocore.config import AioConfig  # type: ignore
+
+    return _get_aio_session().create_client(
+        service_name,
+        endpoint_url=AWS_ENDPOINT_URL,
+        region_name=AWS_REGION,
+        config=AioConfig(
+            max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+            connect_timeout=AWS_CONNECT_TIMEOUT_SECONDS,
+            read_timeout=AWS_READ_TIMEOUT_SECONDS,
+            retries={"mode": AWS_RETRY_MODE, "max_attempts": AWS_MAX_ATTEMPTS},
+        ),
+        **kwargs
+    )
+
+
+@_once
+def _get_aio_session():
+    from aiobotocore.session import get_session as get_aio_session  # type: ignore
+    session = get_aio_session()
+    if METRICS_ENABLED:
+        instrument(session.get_component("event_emitter"))
+    if RATE_LIMIT_ENABLED:
+        install_rate_limiting(session.get_component("event_emitter"), asynchronous=True)
+    return session
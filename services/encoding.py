@@ -0,0 +1,95 @@
+import json
+import zlib
+
+from boto3.dynamodb.types import Binary  # type: ignore
+
+from .config import PRODUCT_IDS_LIST_MAX_BYTES, PRODUCT_IDS_CHUNK_BYTES
+
+# value of the product_ids_format attribute; items written before it existed hold a comma-joined string
+FORMAT_LIST = "list"
+FORMAT_ZLIB = "zlib-json-v1"
+FORMAT_CHUNKED = "zlib-json-v1-chunked"
+FORMAT_ATTRIBUTES = ("product_ids_format", "product_ids_chunks")
+CHUNK_MARKER = "#products#"
+
+
+def encode_product_ids(product_ids: list):
+    """Return (attributes of the shipping item, compressed chunks to store as child items).
+
+    Small orders are stored as a plain list, larger ones as zlib compressed
+    JSON, and orders whose compressed ids do not fit in one item are split
+    into ``PRODUCT_IDS_CHUNK_BYTES`` chunks kept in child items.
+    """
+    product_ids = [str(product_id) for product_id in product_ids]
+    if sum(len(product_id.encode()) for product_id in product_ids) <= PRODUCT_IDS_LIST_MAX_BYTES:
+        return {"product_ids": product_ids, "product_ids_format": FORMAT_LIST}, []
+
+    blob = zlib.compress(json.dumps(product_ids, separators=(",", ":")).encode())
+    if len(blob) <= PRODUCT_IDS_CHUNK_BYTES:
+        return {"product_ids": Binary(blob), "product_ids_format": FORMAT_ZLIB}, []
+
+    chunks = [blob[start:start + PRODUCT_IDS_CHUNK_BYTES] for start in range(0, len(blob), PRODUCT_IDS_CHUNK_BYTES)]
+    return {"product_ids_format": FORMAT_CHUNKED, "product_ids_chunks": len(chunks)}, chunks
+
+
+def decode_product_ids(item: dict, chunks: list = None):
+    """Return the product ids of a stored shipping item in any format.
+
+    ``chunks`` are the product_ids values of the item's child items, in
+    order; they are only needed for the chunked format.
+    """
+    product_ids_format = item.get("product_ids_format")
+    value = item.get("product_ids")
+    if product_ids_format is None:
+        return value.split(",") if value else []
+    if product_ids_format == FORMAT_LIST:
+        return list(value)
+    if product_ids_format == FORMAT_ZLIB:
+        return json.loads(zlib.decompress(bytes(value)))
+    if product_ids_format == FORMAT_CHUNKED:
+        if chunks is None or len(chunks) != int(item["product_ids_chunks"]) or None in chunks:
+            raise ValueError(f"Product id chunks of shipping {item['shipping_id']} are missing")
+        return json.loads(zlib.decompress(b"".join(bytes(chunk) for chunk in chunks)))
+
+    raise ValueError(f"Unknown product_ids format: {product_ids_format}")
+
+
+def decode_shippings(shippings: list, chunks: dict):
+    """Replace the stored product ids of ``shippings`` by decoded lists, in place.
+
+    ``chunks`` maps the keys returned by ``chunk_keys`` to the fetched child
+    items; the format attributes are removed from the shippings.
+    """
+    for shipping in shippings:
+        if "product_ids" in shipping or "product_ids_format" in shipping:
+            shipping["product_ids"] = decode_product_ids(
+                shipping, [chunks.get(key, {}).get("product_ids") for key in chunk_ids(shipping)]
+            )
+        for attribute in FORMAT_ATTRIBUTES:
+            shipping.pop(attribute, None)
+    return shippings
+
+
+def chunk_keys(shippings: list):
+    """Return the keys of every child item needed to decode ``shippings``."""
+    return [key for shipping in shippings for key in chunk_ids(shipping)]
+
+
+def chunk_ids(item: dict):
+    """Return the keys of the child items holding a chunked item's product ids."""
+    if item.get("product_ids_format") != FORMAT_CHUNKED:
+        return []
+    return [f"{item['shipping_id']}{CHUNK_MARKER}{index}" for index in range(int(item["product_ids_chunks"]))]
+
+
+def chunk_items(shipping_id: str, chunks: list):
+    """Return the child items storing ``chunks`` for the given shipping."""
+    return [
+        {"shipping_id": f"{shipping_id}{CHUNK_MARKER}{index}", "product_ids": Binary(chunk)}
+        for index, chunk in enumerate(chunks)
+    ]
+
+
+def is_chunk(item: dict):
+    """Tell whether a scanned item is a product id chunk rather than a shipping."""
+    return CHUNK_MARKER in item["shipping_id"]
@@ -0,0 +1,128 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from .config import EXPORT_SEGMENTS, EXPORT_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ShippingExporter:
+    """Dumps the whole shipping table with a parallel scan.
+
+    Every segment is scanned by its own worker and streamed page by page to
+    ``part-NNNN.ndjson`` (or ``.ndjson.gz``, one gzip member per page) in
+    ``directory``. After each page the segment's LastEvaluatedKey and the
+    byte offset of its part file are saved to ``part-NNNN.checkpoint.json``;
+    running the export again truncates every unfinished part to its last
+    checkpoint and continues from there, so no item is written twice.
+    """
+
+    def __init__(self, repository, directory: str, segments: int = EXPORT_SEGMENTS,
+                 compress: bool = False, page_size: int = EXPORT_PAGE_SIZE):
+        self.repository = repository
+        self.directory = directory
+        self.segments = segments
+        self.compress = compress
+        self.page_size = page_size
+
+    def export(self):
+        # returns {part path: items in the part}; segments already finished are not scanned again
+        os.makedirs(self.directory, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.segments, thread_name_prefix="shipping-export") as executor:
+            counts = list(executor.map(self.export_segment, range(self.segments)))
+        return {self.part_path(segment): count for segment, count in enumerate(counts)}
+
+    def export_segment(self, segment: int):
+        checkpoint = self._load_checkpoint(segment)
+        if checkpoint["done"]:
+            return checkpoint["items"]
+
+        path = self.part_path(segment)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as part:
+            # bytes past the checkpoint belong to a page whose checkpoint was never saved
+            part.seek(checkpoint["offset"])
+            part.truncate()
+            pages = self.repository.scan_segment(
+                segment, self.segments, start_key=checkpoint["last_key"], page_size=self.page_size
+            )
+            for items, last_key in pages:
+                if items:
+                    part.write(self._encode(items))
+                    part.flush()
+                    os.fsync(part.fileno())
+                checkpoint = {
+                    "last_key": last_key,
+                    "offset": part.tell(),
+                    "items": checkpoint["items"] + len(items),
+                    "done": last_key is None,
+                }
+                self._save_checkpoint(segment, checkpoint)
+
+        logger.info("Exported %d shippings from segment %d", checkpoint["items"], segment)
+        return checkpoint["items"]
+
+    def part_path(self, segment: int):
+        suffix = ".ndjson.gz" if self.compress else ".ndjson"
+        return os.path.join(self.directory, f"part-{segment:04d}{suffix}")
+
+    def checkpoint_path(self, segment: int):
+        return os.path.join(self.directory, f"part-{segment:04d}.checkpoint.json")
+
+    def _encode(self, items: list):
+        data = "".join(json.dumps(item, default=_json_default) + "\n" for item in items).encode()
+        return gzip.compress(data) if self.compress else data
+
+    def _load_checkpoint(self, segment: int):
+        try:
+            with open(self.checkpoint_path(segment)) as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return {"last_key": None, "offset": 0, "items": 0, "done": False}
+
+        if checkpoint.get("segments", self.segments) != self.segments:
+            raise ValueError(
+                f"Checkpoint in {self.directory} was written for {checkpoint['segments']} segments, not {self.segments}"
+            )
+        return checkpoint
+
+    def _save_checkpoint(self, segment: int, checkpoint: dict):
+        # written to a temporary file and renamed, so a crash never leaves a half-written checkpoint
+        path = self.checkpoint_path(segment)
+        with open(path + ".tmp", "w") as file:
+            json.dump({**checkpoint, "segments": self.segments}, file, default=_json_default)
+        os.replace(path + ".tmp", path)
+
+
+def main():
+    from .backends import create_repository
+
+    parser = argparse.ArgumentParser(description="Export the shipping table to newline-delimited JSON")
+    parser.add_argument("directory")
+    parser.add_argument("--segments", type=int, default=EXPORT_SEGMENTS)
+    parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    exporter = ShippingExporter(
+        create_repository(), args.directory, segments=args.segments, compress=args.gzip, page_size=args.page_size
+    )
+    counts = exporter.export()
+    logger.info("Exported %d shippings to %s", sum(counts.values()), args.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+import bisect
+import itertools
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from .config import (
+    SHIPPING_TABLE_NAME, SHIPPING_QUEUE, MEMORY_BACKEND_LATENCY_SECONDS, CONSUMER_VISIBILITY_TIMEOUT_SECONDS
+)
+from .encoding import FORMAT_ATTRIBUTES, decode_shippings, chunk_keys, is_chunk
+from .repository import (
+    BATCH_GET_SIZE, TRANSACT_WRITE_SIZE, OUTBOX_PENDING, build_item, child_entries, shipping_entries, created_ids,
+    write_chunks
+)
+from .publisher import SEND_BATCH_SIZE
+from .tracing import message_attributes
+
+# Stand-ins for DynamoDB and SQS living in this process. Every call that would be one request to AWS
+# sleeps ``latency`` seconds once, so batching still pays off and network cost can be simulated.
+_lock = threading.Lock()
+_tables = {}
+_queues = {}
+
+
+def _copy(item: dict):
+    # items only hold strings, numbers, bytes and flat lists
+    return {key: list(value) if isinstance(value, list) else value for key, value in item.items()}
+
+
+def _response_metadata():
+    return {"ResponseMetadata": {"RequestId": str(uuid4()), "HTTPStatusCode": 200, "RetryAttempts": 0}}
+
+
+class MemoryTable:
+    """Thread-safe table of items keyed by shipping_id with DynamoDB-like operations."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get_item(self, key):
+        self._wait()
+        with self._lock:
+            item = self._items.get(key)
+            return _copy(item) if item is not None else None
+
+    def put_item(self, item: dict):
+        self._wait()
+        with self._lock:
+            self._items[item["shipping_id"]] = _copy(item)
+
+    def update_item(self, key, values: dict):
+        # like an UpdateExpression without condition, creates the item when it does not exist
+        self._wait()
+        with self._lock:
+            self._items.setdefault(key, {"shipping_id": key}).update(values)
+
+    def batch_get_item(self, keys: list):
+        self._wait()
+        with self._lock:
+            return {key: _copy(self._items[key]) for key in keys if key in self._items}
+
+    def batch_write_item(self, items: list):
+        self._wait()
+        with self._lock:
+            for item in items:
+                self._items[item["shipping_id"]] = _copy(item)
+
+    def transact_update_items(self, updates: dict, condition=None):
+        # updates: {key: (values to set, attributes to remove)}; condition(item) is checked for every key
+        # first, and nothing is written when it fails for any of them. Returns the keys that failed it.
+        self._wait()
+        with self._lock:
+            failed = [
+                key for key in updates
+                if key not in self._items or (condition is not None and not condition(self._items[key]))
+            ]
+            if failed:
+                return failed
+
+            for key, (values, remove) in updates.items():
+                item = self._items[key]
+                item.update(values)
+                for attribute in remove:
+                    item.pop(attribute, None)
+            return []
+
+    def scan(self, predicate=None, sort_key=None, start_after=None, limit: int = None):
+        # returns (items, last sort key or None), one page of the matching items in sort_key order
+        return next(self.scan_pages(predicate, sort_key, start_after, limit))
+
+    def scan_pages(self, predicate=None, sort_key=None, start_after=None, limit: int = None):
+        """Lazily yield (items, last sort key or None) pages of the matching items in sort_key order.
+
+        The matching keys are sorted once per scan; every page then costs one
+        round trip and re-reads its items, so later writes to them are seen.
+        """
+        sort_key = sort_key or (lambda item: item["shipping_id"])
+        with self._lock:
+            keys = sorted(
+                (sort_key(item), key) for key, item in self._items.items() if predicate is None or predicate(item)
+            )
+        start = 0 if start_after is None else bisect.bisect_right([value for value, _ in keys], start_after)
+        limit = limit or max(1, len(keys) - start)
+        while True:
+            self._wait()
+            end = min(start + limit, len(keys))
+            with self._lock:
+                page = [
+                    _copy(self._items[key]) for _, key in keys[start:end]
+                    if key in self._items and (predicate is None or predicate(self._items[key]))
+                ]
+            last_key = keys[end - 1][0] if end < len(keys) else None
+            yield page, last_key
+
+            if last_key is None:
+                return
+            start = end
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class MemoryQueue:
+    """Thread-safe SQS-like queue with long polling and visibility timeouts."""
+
+    def __init__(self, visibility_timeout: float = 30, latency: float = 0.0, clock=time.monotonic):
+        self.visibility_timeout = visibility_timeout
+        self.latency = latency
+        self.clock = clock
+        # message id -> [body, visible at, current receipt handle, sent timestamp in ms, message attributes]
+        self._messages = OrderedDict()
+        self._receipts = {}
+        self._sequence = itertools.count()
+        self._available = threading.Condition()
+
+    def send_messages(self, bodies: list, attributes: list = None):
+        self._wait()
+        attributes = attributes or [{}] * len(bodies)
+        message_ids = []
+        with self._available:
+            for body, message_attributes in zip(bodies, attributes):
+                message_id = str(uuid4())
+                self._messages[message_id] = [body, self.clock(), None, int(time.time() * 1000), message_attributes]
+                message_ids.append(message_id)
+            self._available.notify_all()
+        return message_ids
+
+    def receive_messages(self, max_messages: int = 1, wait_time: float = 0, visibility_timeout: float = None):
+        self._wait()
+        visibility_timeout = self.visibility_timeout if visibility_timeout is None else visibility_timeout
+        deadline = time.monotonic() + wait_time
+        with self._available:
+            while True:
+                now = self.clock()
+                messages = []
+                for message_id, message in self._messages.items():
+                    if message[1] > now:
+                        continue
+                    receipt_handle = f"{message_id}#{next(self._sequence)}"
+                    self._receipts.pop(message[2], None)
+                    self._receipts[receipt_handle] = message_id
+                    message[1] = now + visibility_timeout
+                    message[2] = receipt_handle
+                    messages.append({
+                        "MessageId": message_id,
+                        "ReceiptHandle": receipt_handle,
+                        "Body": message[0],
+                        "Attributes": {"SentTimestamp": str(message[3])},
+                        **({"MessageAttributes": message[4]} if message[4] else {}),
+                    })
+                    if len(messages) >= max_messages:
+                        break
+
+                remaining = deadline - time.monotonic()
+                if messages or remaining <= 0:
+                    return messages
+                # wake up when the first in-flight message becomes visible again, or on a new message
+                next_visible = min((message[1] for message in self._messages.values()), default=now + remaining)
+                self._available.wait(min(remaining, max(0.0, next_visible - now)))
+
+    def delete_messages(self, receipt_handles: list):
+        # returns errors keyed by index of the receipt handle
+        return self._by_receipt(receipt_handles, self._delete)
+
+    def change_visibility(self, receipt_handles: list, visibility_timeout: float):
+        def change(message_id):
+            self._messages[message_id][1] = self.clock() + visibility_timeout
+            if visibility_timeout <= 0:
+                self._available.notify_all()
+
+        return self._by_receipt(receipt_handles, change)
+
+    def clear(self):
+        with self._available:
+            self._messages.clear()
+            self._receipts.clear()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def _delete(self, message_id):
+        self._receipts.pop(self._messages.pop(message_id)[2], None)
+
+    def _by_receipt(self, receipt_handles: list, operation):
+        self._wait()
+        errors = {}
+        with self._available:
+            for index, receipt_handle in enumerate(receipt_handles):
+                message_id = self._receipts.get(receipt_handle)
+                if message_id is None:
+                    errors[index] = f"The receipt handle {receipt_handle} is not valid"
+                    continue
+                operation(message_id)
+        return errors
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def get_memory_table(name: str = SHIPPING_TABLE_NAME):
+    # one table per name and process, so every repository built by the factories sees the same items
+    with _lock:
+        if name not in _tables:
+            _tables[name] = MemoryTable(latency=MEMORY_BACKEND_LATENCY_SECONDS)
+        return _tables[name]
+
+
+def get_memory_queue(name: str = SHIPPING_QUEUE):
+    with _lock:
+        if name not in _queues:
+            _queues[name] = MemoryQueue(
+                visibility_timeout=CONSUMER_VISIBILITY_TIMEOUT_SECONDS, latency=MEMORY_BACKEND_LATENCY_SECONDS
+            )
+        return _queues[name]
+
+
+class MemoryShippingRepository:
+    """ShippingRepository backed by a MemoryTable instead of DynamoDB.
+
+    Items are built and encoded exactly as ShippingRepository stores them,
+    and batches are split at the same sizes, so the number of simulated
+    round trips matches the real backend.
+    """
+
+    def __init__(self, table: MemoryTable = None):
+        self.table = table if table is not None else get_memory_table()
+
+    def get_shipping(self, shipping_id, attributes: list = None, consistent: bool = False):
+        item = self.table.get_item(shipping_id)
+        return self._decode([self._project(item, attributes)])[0] if item is not None else None
+
+    def get_shipping_batch(self, shipping_ids: list, attributes: list = None, consistent: bool = False):
+        shippings = {
+            shipping_id: self._project(item, attributes, with_key=True)
+            for shipping_id, item in self._batch_get(shipping_ids).items()
+        }
+        self._decode(list(shippings.values()))
+        return shippings
+
+    def create_shipping(self, shipping_type: str, product_ids: list, order_id: str, status: str, due_date: datetime,
+                        outbox: bool = False, traceparent: str = None):
+        item, children = build_item(shipping_type, product_ids, order_id, status, due_date, outbox, traceparent)
+        self._batch_put(children)
+        self.table.put_item(item)
+        return item["shipping_id"]
+
+    def create_shipping_batch(self, shippings: list):
+        built = [build_item(**shipping) for shipping in shippings]
+        self._batch_put([child for _, child in child_entries(built)])
+        self._batch_put([item for _, item in shipping_entries(built, {})])
+        return created_ids(built, {}), {}
+
+    def update_shipping_status(self, shipping_id, status):
+        self.table.update_item(shipping_id, {"shipping_status": status})
+        return _response_metadata()
+
+    def update_shipping_status_batch(self, statuses: dict, expected_status: str = None):
+        def in_expected_status(item):
+            return item.get("shipping_status") == expected_status
+
+        return self._transact_updates(
+            {shipping_id: ({"shipping_status": status}, ()) for shipping_id, status in statuses.items()},
+            in_expected_status if expected_status is not None else None
+        )
+
+    def list_shippings_by_status(self, status: str, due_before: datetime = None, page_size: int = 100):
+        due_before = due_before.astimezone(timezone.utc).isoformat() if due_before is not None else None
+
+        def matches(item):
+            return item.get("shipping_status") == status and "due_date" in item \
+                and (due_before is None or item["due_date"] < due_before)
+
+        shippings = self._paginate(matches, lambda item: (item["due_date"], item["shipping_id"]), page_size)
+        return (
+            {key: shipping[key] for key in ("shipping_id", "shipping_status", "due_date")} for shipping in shippings
+        )
+
+    def list_shippings_by_order(self, order_id: str, page_size: int = 100):
+        shippings = self._paginate(
+            lambda item: item.get("order_id") == order_id and "created_date" in item,
+            lambda item: (item["created_date"], item["shipping_id"]),
+            page_size
+        )
+        return (self._decode([shipping])[0] for shipping in shippings)
+
+    def list_outbox(self, limit: int = 100):
+        items, _ = self.table.scan(
+            lambda item: item.get("outbox_status") == OUTBOX_PENDING and "created_date" in item,
+            lambda item: (item["created_date"], item["shipping_id"]),
+            limit=limit
+        )
+        return {item["shipping_id"]: item.get("traceparent") for item in items}
+
+    def clear_outbox_batch(self, shipping_ids: list):
+        return self._transact_updates({shipping_id: ({}, ("outbox_status",)) for shipping_id in shipping_ids})
+
+    def scan_segment(self, segment: int, total_segments: int, start_key: dict = None, page_size: int = 1000):
+        pages = self.table.scan_pages(
+            lambda item: zlib.crc32(item["shipping_id"].encode()) % total_segments == segment,
+            start_after=start_key["shipping_id"] if start_key else None,
+            limit=page_size
+        )
+        for items, last_key in pages:
+            shippings = [item for item in items if not is_chunk(item)]
+            yield self._decode(shippings), {"shipping_id": last_key} if last_key is not None else None
+
+    def _paginate(self, predicate, sort_key, page_size: int):
+        for items, _ in self.table.scan_pages(predicate, sort_key, limit=page_size):
+            yield from items
+
+    def _transact_updates(self, updates: dict, condition=None):
+        responses = {}
+        errors = {}
+        shipping_ids = list(updates)
+        for start in range(0, len(shipping_ids), TRANSACT_WRITE_SIZE):
+            chunk = {shipping_id: updates[shipping_id] for shipping_id in shipping_ids[start:start + TRANSACT_WRITE_SIZE]}
+            while chunk:
+                failed = self.table.transact_update_items(chunk, condition)
+                if not failed:
+                    response = _response_metadata()
+                    responses.update((shipping_id, response) for shipping_id in chunk)
+                    break
+
+                for shipping_id in failed:
+                    errors[shipping_id] = "Transaction cancelled, ConditionalCheckFailed"
+                    del chunk[shipping_id]
+
+        return responses, errors
+
+    def _batch_get(self, shipping_ids: list):
+        shipping_ids = list(dict.fromkeys(shipping_ids))
+        shippings = {}
+        for start in range(0, len(shipping_ids), BATCH_GET_SIZE):
+            shippings.update(self.table.batch_get_item(shipping_ids[start:start + BATCH_GET_SIZE]))
+        return shippings
+
+    def _batch_put(self, items: list):
+        for chunk in write_chunks(list(enumerate(items))):
+            self.table.batch_write_item([item for _, item in chunk])
+
+    def _decode(self, shippings: list):
+        keys = chunk_keys(shippings)
+        return decode_shippings(shippings, self._batch_get(keys) if keys else {})
+
+    @staticmethod
+    def _project(item: dict, attributes: list = None, with_key: bool = False):
+        if not attributes:
+            return item
+        attributes = set(attributes)
+        if with_key:
+            attributes.add("shipping_id")
+        if "product_ids" in attributes:
+            attributes.update(("shipping_id", *FORMAT_ATTRIBUTES))
+        return {key: value for key, value in item.items() if key in attributes}
+
+
+class MemoryShippingPublisher:
+    """ShippingPublisher backed by a MemoryQueue instead of SQS."""
+
+    def __init__(self, queue: MemoryQueue = None):
+        self.queue = queue if queue is not None else get_memory_queue()
+
+    def send_new_shipping(self, shipping_id: str):
+        return self.queue.send_messages([shipping_id], [message_attributes()])[0]
+
+    def send_new_shipping_batch(self, shipping_ids: list, attributes: list = None):
+        shipping_ids = list(shipping_ids)
+        attributes = attributes or [message_attributes()] * len(shipping_ids)
+        message_ids = []
+        for start in range(0, len(shipping_ids), SEND_BATCH_SIZE):
+            message_ids.extend(self.queue.send_messages(
+                shipping_ids[start:start + SEND_BATCH_SIZE], attributes[start:start + SEND_BATCH_SIZE]
+            ))
+        return message_ids, {}
+
+    def poll_shipping(self, batch_size: int = 10):
+        return [msg['Body'] for msg in self.receive_shippings(batch_size)]
+
+    def receive_shippings(self, batch_size: int = 10, wait_time: int = 10, visibility_timeout: int = None):
+        return self.queue.receive_messages(batch_size, wait_time=wait_time, visibility_timeout=visibility_timeout)
+
+    def delete_shippings(self, receipt_handles: list):
+        return self._receipt_batch(self.queue.delete_messages, receipt_handles)
+
+    def extend_visibility(self, receipt_handles: list, visibility_timeout: int):
+        return self._receipt_batch(
+            lambda handles: self.queue.change_visibility(handles, visibility_timeout), receipt_handles
+        )
+
+    @staticmethod
+    def _receipt_batch(operation, receipt_handles: list):
+        errors = {}
+        for start in range(0, len(receipt_handles), SEND_BATCH_SIZE):
+            for offset, error in operation(receipt_handles[start:start + SEND_BATCH_SIZE]).items():
+                errors[start + offset] = error
+        return errors
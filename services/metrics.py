@@ -0,0 +1,230 @@
+import bisect
+import json
+import threading
+import time
+
+from .config import METRICS_CONSUMED_CAPACITY
+
+# upper bounds of the latency histogram buckets in seconds, as in the Prometheus client defaults
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # (upper bound, observations <= bound) pairs ending with +Inf, as Prometheus expects
+        total = 0
+        result = []
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class OperationMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = {}
+        self.retries = 0
+        self.unprocessed = 0
+        self.consumed_capacity = 0.0
+        self.throttles = 0
+        self.rate_limit_wait_seconds = 0.0
+        self.latency = Histogram()
+
+
+class MetricsRegistry:
+    """In-process aggregate of AWS calls per (service, operation).
+
+    Filled by the botocore event handlers that ``instrument`` registers;
+    ``snapshot`` returns plain dicts, ``to_json`` and ``to_prometheus``
+    render them for a debug endpoint or a log line.
+    """
+
+    def __init__(self):
+        self._operations = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def record(self, service: str, operation: str, seconds: float, error: str = None, retries: int = 0,
+               unprocessed: int = 0, consumed_capacity: float = 0.0):
+        with self._lock:
+            metrics = self._get(service, operation)
+            metrics.calls += 1
+            if error is not None:
+                metrics.errors[error] = metrics.errors.get(error, 0) + 1
+            metrics.retries += retries
+            metrics.unprocessed += unprocessed
+            metrics.consumed_capacity += consumed_capacity
+            metrics.latency.observe(seconds)
+
+    def add(self, service: str, operation: str, **amounts):
+        # adds to counters recorded outside of a call, such as throttles=1
+        with self._lock:
+            metrics = self._get(service, operation)
+            for name, amount in amounts.items():
+                setattr(metrics, name, getattr(metrics, name) + amount)
+
+    def set_gauge(self, name: str, service: str, value: float):
+        with self._lock:
+            self._gauges[(name, service)] = value
+
+    def gauges(self):
+        with self._lock:
+            return {f"{name}.{service}": value for (name, service), value in sorted(self._gauges.items())}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                f"{service}.{operation}": {
+                    "calls": metrics.calls,
+                    "errors": dict(metrics.errors),
+                    "retries": metrics.retries,
+                    "unprocessed": metrics.unprocessed,
+                    "consumed_capacity": metrics.consumed_capacity,
+                    "throttles": metrics.throttles,
+                    "rate_limit_wait_seconds": metrics.rate_limit_wait_seconds,
+                    "latency_seconds": {
+                        "sum": metrics.latency.sum,
+                        "count": metrics.latency.count,
+                        "buckets": {_bound(bound): count for bound, count in metrics.latency.cumulative()},
+                    },
+                }
+                for (service, operation), metrics in sorted(self._operations.items())
+            }
+
+    def to_json(self):
+        return json.dumps({"operations": self.snapshot(), "gauges": self.gauges()}, indent=2)
+
+    def to_prometheus(self):
+        lines = []
+        snapshot = self.snapshot()
+        counters = (
+            ("aws_client_calls_total", "AWS API calls", "calls"),
+            ("aws_client_retries_total", "Retries made by botocore", "retries"),
+            ("aws_client_unprocessed_total", "Batch entries returned unprocessed or failed", "unprocessed"),
+            ("aws_client_consumed_capacity_total", "DynamoDB capacity units consumed", "consumed_capacity"),
+            ("aws_client_throttles_total", "Attempts throttled or left partially unprocessed", "throttles"),
+            ("aws_client_rate_limit_wait_seconds_total", "Time spent waiting for the rate limiter",
+             "rate_limit_wait_seconds"),
+        )
+        for name, description, key in counters:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [f"{name}{{{_labels(operation)}}} {metrics[key]}" for operation, metrics in snapshot.items()]
+
+        lines += ["# HELP aws_client_errors_total Failed AWS API calls", "# TYPE aws_client_errors_total counter"]
+        for operation, metrics in snapshot.items():
+            for code, count in sorted(metrics["errors"].items()):
+                lines.append(f'aws_client_errors_total{{{_labels(operation)},code="{code}"}} {count}')
+
+        name = "aws_client_latency_seconds"
+        lines += [f"# HELP {name} Latency of AWS API calls including retries", f"# TYPE {name} histogram"]
+        for operation, metrics in snapshot.items():
+            latency = metrics["latency_seconds"]
+            for bound, count in latency["buckets"].items():
+                lines.append(f'{name}_bucket{{{_labels(operation)},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{_labels(operation)}}} {latency['sum']}")
+            lines.append(f"{name}_count{{{_labels(operation)}}} {latency['count']}")
+
+        name = "aws_client_rate_limit_rps"
+        lines += [f"# HELP {name} Current rate of the adaptive rate limiter", f"# TYPE {name} gauge"]
+        for (gauge, service), value in sorted(self._gauges.items()):
+            if gauge == "rate_limit_rps":
+                lines.append(f'{name}{{service="{service}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._gauges.clear()
+
+    def _get(self, service: str, operation: str):
+        metrics = self._operations.get((service, operation))
+        if metrics is None:
+            metrics = self._operations[(service, operation)] = OperationMetrics()
+        return metrics
+
+
+def _bound(bound: float):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _labels(operation: str):
+    service, name = operation.split(".", 1)
+    return f'service="{service}",operation="{name}"'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def instrument(events, registry: MetricsRegistry = REGISTRY):
+    """Register the metrics handlers on a botocore event emitter.
+
+    Pass ``session.events`` of a boto3 session, or the event_emitter
+    component of a (aio)botocore session, so every client created from it
+    is measured. Registering twice is a no-op.
+    """
+    def before_call(context, **kwargs):
+        context["metrics_started"] = time.perf_counter()
+
+    def after_call(event_name, http_response, parsed, context, **kwargs):
+        _, service, operation = event_name.split(".", 2)
+        error = parsed.get("Error", {}).get("Code", "Unknown") if http_response.status_code >= 300 else None
+        registry.record(
+            service, operation, _elapsed(context), error=error,
+            retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+            unprocessed=_unprocessed(parsed),
+            consumed_capacity=_consumed_capacity(parsed.get("ConsumedCapacity")),
+        )
+
+    def after_call_error(event_name, exception, context, **kwargs):
+        _, service, operation = event_name.split(".", 2)
+        registry.record(service, operation, _elapsed(context), error=type(exception).__name__)
+
+    uid = f"metrics-{id(registry)}"
+    events.register("before-call", before_call, unique_id=f"{uid}-before-call")
+    events.register("after-call", after_call, unique_id=f"{uid}-after-call")
+    events.register("after-call-error", after_call_error, unique_id=f"{uid}-after-call-error")
+    if METRICS_CONSUMED_CAPACITY:
+        events.register("before-parameter-build.dynamodb", _request_consumed_capacity,
+                        unique_id="metrics-consumed-capacity")
+
+
+def _request_consumed_capacity(params, model, **kwargs):
+    if "ReturnConsumedCapacity" in model.input_shape.members and "ReturnConsumedCapacity" not in params:
+        params["ReturnConsumedCapacity"] = "TOTAL"
+
+
+def _elapsed(context):
+    started = context.get("metrics_started")
+    return time.perf_counter() - started if started is not None else 0.0
+
+
+def _unprocessed(parsed: dict):
+    # DynamoDB batch items sent back for a retry, or SQS batch entries that failed
+    count = len(parsed.get("Failed", []))
+    for table in parsed.get("UnprocessedItems", {}).values():
+        count += len(table)
+    for table in parsed.get("UnprocessedKeys", {}).values():
+        count += len(table.get("Keys", []))
+    return count
+
+
+def _consumed_capacity(consumed):
+    # a single dict for item operations, a list with one entry per table for batches and transactions
+    if not consumed:
+        return 0.0
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return float(sum(entry.get("CapacityUnits", 0) for entry in consumed))
@@ -0,0 +1,41 @@
+import threading
+
+from .config import OUTBOX_RELAY_INTERVAL_SECONDS
+from .tracing import message_attributes
+
+
+class ShippingOutboxRelay:
+    """Publishes shippings created with ``outbox=True`` and clears their outbox marker.
+
+    A shipping is only cleared after it was accepted by SQS, so a crash
+    between the two steps leads to a duplicate message, never a lost one.
+    Each message carries the trace context its shipping was created in.
+    """
+
+    def __init__(self, repository, publisher, batch_size: int = 100):
+        self.repository = repository
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+
+    def relay_once(self):
+        pending = self.repository.list_outbox(self.batch_size)
+        if not pending:
+            return 0
+
+        shipping_ids = list(pending)
+        _, publish_errors = self.publisher.send_new_shipping_batch(
+            shipping_ids, [message_attributes(traceparent) for traceparent in pending.values()]
+        )
+        published = [shipping_id for index, shipping_id in enumerate(shipping_ids) if index not in publish_errors]
+        responses, _ = self.repository.clear_outbox_batch(published)
+        return len(responses)
+
+    def run(self, interval: float = OUTBOX_RELAY_INTERVAL_SECONDS):
+        self._stop.clear()
+        while not self._stop.is_set():
+            if self.relay_once() < self.batch_size:
+                self._stop.wait(interval)
+
+    def stop(self):
+        self._stop.set()
@@ -1,37 +1,295 @@
-import boto3 # type: ignore
+import asyncio
+import threading
+from concurrent.futures import Future
+from contextlib import AsyncExitStack
 
-from .config import AWS_ENDPOINT_URL, AWS_REGION, SHIPPING_QUEUE
+from botocore.exceptions import BotoCoreError, ClientError  # type: ignore
+
+from .config import SHIPPING_QUEUE, PUBLISHER_MAX_LINGER_SECONDS
+from .db import get_aio_client, get_queue_url, get_sqs_client
+from .retry import BATCH_MAX_RETRIES, backoff_delay, sleep_backoff
+from .tracing import message_attributes
+
+SEND_BATCH_SIZE = 10
+
+
+def _entry(attributes: dict = None, **fields):
+    # message fields with the trace context attributes, which SQS rejects when empty
+    return {**fields, 'MessageAttributes': attributes} if attributes else fields
 
 
 class ShippingPublisher:
     def __init__(self):
-        self.client = boto3.client(
-            "sqs",
-            endpoint_url=AWS_ENDPOINT_URL,
-            region_name=AWS_REGION,
-            aws_access_key_id="test",
-            aws_secret_access_key="test",
-        )
-        response = self.client.create_queue(QueueName=SHIPPING_QUEUE)
-        self.queue_url = response["QueueUrl"]
+        self.client = get_sqs_client()
+        self.queue_url = get_queue_url(SHIPPING_QUEUE)
 
     def send_new_shipping(self, shipping_id: str):
         response = self.client.send_message(
             QueueUrl=self.queue_url,
-            MessageBody=shipping_id
+            **_entry(message_attributes(), MessageBody=shipping_id)
         )
 
         return response['MessageId']
 
+    def send_new_shipping_batch(self, shipping_ids: list, attributes: list = None):
+        # returns message ids in input order and errors keyed by input index; attributes default to the
+        # current trace context for every message
+        shipping_ids = list(shipping_ids)
+        attributes = attributes or [message_attributes()] * len(shipping_ids)
+        message_ids = [None] * len(shipping_ids)
+        errors = {}
+        for start in range(0, len(shipping_ids), SEND_BATCH_SIZE):
+            entries = {
+                str(index): shipping_ids[index]
+                for index in range(start, min(start + SEND_BATCH_SIZE, len(shipping_ids)))
+            }
+            attempt = 0
+            while entries:
+                try:
+                    response = self.client.send_message_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=[
+                            _entry(attributes[int(entry_id)], Id=entry_id, MessageBody=body)
+                            for entry_id, body in entries.items()
+                        ]
+                    )
+                except (BotoCoreError, ClientError) as error:
+                    # connection errors fail this chunk only, the chunks already sent keep their ids
+                    for entry_id in entries:
+                        errors[int(entry_id)] = str(error)
+                    break
+
+                for success in response.get('Successful', []):
+                    message_ids[int(success['Id'])] = success['MessageId']
+
+                retry = {}
+                for failure in response.get('Failed', []):
+                    if failure.get('SenderFault') or attempt >= BATCH_MAX_RETRIES:
+                        errors[int(failure['Id'])] = failure.get('Message', failure['Code'])
+                    else:
+                        retry[failure['Id']] = entries[failure['Id']]
+
+                entries = retry
+                if entries:
+                    sleep_backoff(attempt)
+                    attempt += 1
+
+        return message_ids, errors
+
     def poll_shipping(self, batch_size: int = 10):
+        return [msg['Body'] for msg in self.receive_shippings(batch_size)]
+
+    def receive_shippings(self, batch_size: int = 10, wait_time: int = 10, visibility_timeout: int = None):
+        kwargs = {'VisibilityTimeout': visibility_timeout} if visibility_timeout is not None else {}
         messages = self.client.receive_message(
             QueueUrl=self.queue_url,
+            AttributeNames=['SentTimestamp'],
+            MessageAttributeNames=['All'],
+            MaxNumberOfMessages=batch_size,
+            WaitTimeSeconds=wait_time,
+            **kwargs
+        )
+
+        return messages.get('Messages', [])
+
+    def delete_shippings(self, receipt_handles: list):
+        return self._receipt_batch(self.client.delete_message_batch, receipt_handles)
+
+    def extend_visibility(self, receipt_handles: list, visibility_timeout: int):
+        return self._receipt_batch(
+            self.client.change_message_visibility_batch, receipt_handles, VisibilityTimeout=visibility_timeout
+        )
+
+    def _receipt_batch(self, operation, receipt_handles: list, **entry_fields):
+        # returns errors keyed by index of the receipt handle
+        errors = {}
+        for start in range(0, len(receipt_handles), SEND_BATCH_SIZE):
+            response = operation(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {'Id': str(index), 'ReceiptHandle': receipt_handles[index], **entry_fields}
+                    for index in range(start, min(start + SEND_BATCH_SIZE, len(receipt_handles)))
+                ]
+            )
+            for failure in response.get('Failed', []):
+                errors[int(failure['Id'])] = failure.get('Message', failure['Code'])
+
+        return errors
+
+
+class BufferedShippingPublisher(ShippingPublisher):
+    """Collects shipping ids and sends them with send_message_batch.
+
+    The buffer is flushed when it holds ``max_batch_size`` ids, when the
+    oldest buffered id has waited ``max_linger`` seconds, and on exit from
+    the context manager. ``send_new_shipping`` returns a Future resolving
+    to the MessageId.
+    """
+
+    def __init__(self, max_batch_size: int = SEND_BATCH_SIZE, max_linger: float = PUBLISHER_MAX_LINGER_SECONDS):
+        super().__init__()
+        self.max_batch_size = min(max_batch_size, SEND_BATCH_SIZE)
+        self.max_linger = max_linger
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def send_new_shipping(self, shipping_id: str):
+        future = Future()
+        batch = None
+        with self._lock:
+            self._buffer.append((shipping_id, future, message_attributes()))
+            if len(self._buffer) >= self.max_batch_size:
+                batch = self._take_buffer()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_linger, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if batch:
+            self._send(batch)
+        return future
+
+    def flush(self):
+        with self._lock:
+            batch = self._take_buffer()
+
+        if batch:
+            self._send(batch)
+
+    def _take_buffer(self):
+        batch, self._buffer = self._buffer, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _send(self, batch):
+        try:
+            message_ids, errors = self.send_new_shipping_batch(
+                [shipping_id for shipping_id, _, _ in batch], [attributes for _, _, attributes in batch]
+            )
+        except Exception as error:
+            for _, future, _ in batch:
+                future.set_exception(error)
+            return
+
+        for index, (_, future, _) in enumerate(batch):
+            if index in errors:
+                future.set_exception(RuntimeError(errors[index]))
+            else:
+                future.set_result(message_ids[index])
+
+
+class AsyncShippingPublisher:
+    """asyncio counterpart of ShippingPublisher sharing one aiobotocore SQS client."""
+
+    _queue_urls = {}
+
+    def __init__(self, client=None):
+        self.client = client
+        self.queue_url = None
+        self._exit_stack = None
+
+    async def __aenter__(self):
+        if self.client is None:
+            self._exit_stack = AsyncExitStack()
+            self.client = await self._exit_stack.enter_async_context(
+                get_aio_client("sqs", aws_access_key_id="test", aws_secret_access_key="test")
+            )
+        if SHIPPING_QUEUE not in self._queue_urls:
+            response = await self.client.create_queue(QueueName=SHIPPING_QUEUE)
+            self._queue_urls[SHIPPING_QUEUE] = response["QueueUrl"]
+        self.queue_url = self._queue_urls[SHIPPING_QUEUE]
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self.client = None
+
+    async def send_new_shipping(self, shipping_id: str):
+        response = await self.client.send_message(
+            QueueUrl=self.queue_url, **_entry(message_attributes(), MessageBody=shipping_id)
+        )
+        return response['MessageId']
+
+    async def send_new_shipping_batch(self, shipping_ids: list, attributes: list = None):
+        shipping_ids = list(shipping_ids)
+        attributes = attributes or [message_attributes()] * len(shipping_ids)
+        message_ids = [None] * len(shipping_ids)
+        errors = {}
+        await asyncio.gather(*(
+            self._send_batch(shipping_ids, range(start, min(start + SEND_BATCH_SIZE, len(shipping_ids))),
+                             attributes, message_ids, errors)
+            for start in range(0, len(shipping_ids), SEND_BATCH_SIZE)
+        ))
+        return message_ids, errors
+
+    async def poll_shipping(self, batch_size: int = 10):
+        return [msg['Body'] for msg in await self.receive_shippings(batch_size)]
+
+    async def receive_shippings(self, batch_size: int = 10, wait_time: int = 10, visibility_timeout: int = None):
+        kwargs = {'VisibilityTimeout': visibility_timeout} if visibility_timeout is not None else {}
+        messages = await self.client.receive_message(
+            QueueUrl=self.queue_url,
+            AttributeNames=['SentTimestamp'],
             MessageAttributeNames=['All'],
             MaxNumberOfMessages=batch_size,
-            WaitTimeSeconds=10
+            WaitTimeSeconds=wait_time,
+            **kwargs
         )
+        return messages.get('Messages', [])
+
+    async def delete_shippings(self, receipt_handles: list):
+        errors = {}
+        for start in range(0, len(receipt_handles), SEND_BATCH_SIZE):
+            response = await self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {'Id': str(index), 'ReceiptHandle': receipt_handles[index]}
+                    for index in range(start, min(start + SEND_BATCH_SIZE, len(receipt_handles)))
+                ]
+            )
+            for failure in response.get('Failed', []):
+                errors[int(failure['Id'])] = failure.get('Message', failure['Code'])
+        return errors
+
+    async def _send_batch(self, shipping_ids, indexes, attributes, message_ids, errors):
+        entries = {str(index): shipping_ids[index] for index in indexes}
+        attempt = 0
+        while entries:
+            try:
+                response = await self.client.send_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        _entry(attributes[int(entry_id)], Id=entry_id, MessageBody=body)
+                        for entry_id, body in entries.items()
+                    ]
+                )
+            except (BotoCoreError, ClientError) as error:
+                for entry_id in entries:
+                    errors[int(entry_id)] = str(error)
+                return
+
+            for success in response.get('Successful', []):
+                message_ids[int(success['Id'])] = success['MessageId']
 
-        if 'Messages' not in messages:
-            return []
+            retry = {}
+            for failure in response.get('Failed', []):
+                if failure.get('SenderFault') or attempt >= BATCH_MAX_RETRIES:
+                    errors[int(failure['Id'])] = failure.get('Message', failure['Code'])
+                else:
+                    retry[failure['Id']] = entries[failure['Id']]
 
-        return [msg['Body'] for msg in messages['Messages']]
+            entries = retry
+            if entries:
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
@@ -1,35 +1,197 @@
-from .config import SHIPPING_TABLE_NAME
-from .db import get_dynamodb_resource
+from boto3.dynamodb.conditions import Key  # type: ignore
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer  # type: ignore
+from botocore.exceptions import ClientError  # type: ignore
 
+from .config import (
+    SHIPPING_TABLE_NAME, SHIPPING_OUTBOX_INDEX, SHIPPING_STATUS_DUE_INDEX, SHIPPING_ORDER_INDEX
+)
+from .db import LocalTable, get_aio_client
+from .encoding import FORMAT_ATTRIBUTES, encode_product_ids, decode_shippings, chunk_keys, chunk_items, is_chunk
+from .retry import BATCH_MAX_RETRIES, backoff_delay, sleep_backoff
+
+import asyncio
+import time
+from contextlib import AsyncExitStack
 from uuid import uuid4
 from datetime import datetime, timezone
 
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+TRANSACT_WRITE_SIZE = 25
+OUTBOX_PENDING = "pending"
+
+
+def projection(attributes: list = None, with_key: bool = False):
+    # ProjectionExpression kwargs for reading only the given attributes; all of them when None
+    if not attributes:
+        return {}
+
+    if with_key and "shipping_id" not in attributes:
+        attributes = ["shipping_id", *attributes]
+    if "product_ids" in attributes:
+        # the key and the format tags are needed to decode product_ids
+        attributes = list(dict.fromkeys(["shipping_id", *attributes, *FORMAT_ATTRIBUTES]))
+    names = {f"#attr{index}": attribute for index, attribute in enumerate(attributes)}
+    return {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+
+def build_item(shipping_type: str, product_ids: list, order_id: str, status: str, due_date: datetime,
+               outbox: bool = False, traceparent: str = None):
+    # returns the shipping item and the child items its product ids spilled into
+    item = {
+        "shipping_id": str(uuid4()),
+        "shipping_type": shipping_type,
+        "order_id": order_id,
+        "shipping_status": status,
+        "created_date": datetime.now(timezone.utc).isoformat(),
+        "due_date": due_date.replace(tzinfo=timezone.utc).isoformat()
+    }
+    attributes, chunks = encode_product_ids(product_ids)
+    item.update(attributes)
+    if outbox:
+        item["outbox_status"] = OUTBOX_PENDING
+        if traceparent is not None:
+            # the relay sends the message from this trace context
+            item["traceparent"] = traceparent
+    return item, chunk_items(item["shipping_id"], chunks)
+
+
+def child_entries(built: list):
+    # (input index, item) pairs of the product id chunks of built (item, children) pairs; they are
+    # written before the shippings, so a shipping is never visible without its product ids
+    return [(index, child) for index, (_, children) in enumerate(built) for child in children]
+
+
+def shipping_entries(built: list, errors: dict):
+    return [(index, item) for index, (item, _) in enumerate(built) if index not in errors]
+
+
+def created_ids(built: list, errors: dict):
+    return [None if index in errors else item["shipping_id"] for index, (item, _) in enumerate(built)]
+
+
+def write_chunks(entries: list):
+    # splits (input index, item) pairs into batch_write_item sized chunks
+    return [entries[start:start + BATCH_WRITE_SIZE] for start in range(0, len(entries), BATCH_WRITE_SIZE)]
+
+
+def merge_chunk_errors(chunk: list, chunk_errors: dict, errors: dict):
+    # maps errors keyed by offset in the chunk to the input index, keeping the first error of every index
+    for offset, error in chunk_errors.items():
+        errors.setdefault(chunk[offset][0], error)
+    return errors
+
+
+class BatchPut:
+    """Retry bookkeeping of one batch_write_item call, shared by the sync and async repositories.
+
+    Unprocessed requests are retried with backoff; once BATCH_MAX_RETRIES
+    is used up, or the call fails, the remaining items get an error keyed
+    by their offset in ``items``.
+    """
+
+    def __init__(self, table_name: str, items: list, serialize=None, key=lambda item: item["shipping_id"]):
+        self.table_name = table_name
+        self.key = key
+        self.offsets = {item["shipping_id"]: offset for offset, item in enumerate(items)}
+        self.requests = [{"PutRequest": {"Item": serialize(item) if serialize else item}} for item in items]
+        self.errors = {}
+        self.attempt = 0
+
+    def request_items(self):
+        return {self.table_name: self.requests}
+
+    def fail(self, message: str):
+        for request in self.requests:
+            self.errors[self.offsets[self.key(request["PutRequest"]["Item"])]] = message
+        self.requests = []
+
+    def retry_delay(self, response: dict):
+        # returns how long to wait before sending the unprocessed requests again, None when done
+        self.requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+        if not self.requests:
+            return None
+        if self.attempt >= BATCH_MAX_RETRIES:
+            self.fail(f"Item was not processed after {BATCH_MAX_RETRIES} retries")
+            return None
+
+        delay = backoff_delay(self.attempt)
+        self.attempt += 1
+        return delay
+
 
 class ShippingRepository:
 
 
     def __init__(self):
-        dynamo_resource = get_dynamodb_resource()
-        self.table = dynamo_resource.Table(SHIPPING_TABLE_NAME)
-
-
-    def get_shipping(self, shipping_id):
-        response = self.table.get_item(Key={"shipping_id": shipping_id})
-        return response.get("Item")
-
-    def create_shipping(self, shipping_type: str, product_ids: list, order_id: str, status: str, due_date: datetime):
-        shipping_id = str(uuid4())
-        item = {
-            "shipping_id": shipping_id,
-            "shipping_type": shipping_type,
-            "order_id": order_id,
-            "product_ids": ",".join(product_ids),
-            "shipping_status": status,
-            "created_date": datetime.now(timezone.utc).isoformat(),
-            "due_date": due_date.replace(tzinfo=timezone.utc).isoformat()
-        }
+        self._table = LocalTable(SHIPPING_TABLE_NAME)
+
+    @property
+    def table(self):
+        # the repository is used from worker threads, and boto3 resources must not be shared between them
+        return self._table.get()
+
+
+    def get_shipping(self, shipping_id, attributes: list = None, consistent: bool = False):
+        response = self.table.get_item(
+            Key={"shipping_id": shipping_id},
+            ConsistentRead=consistent,
+            **projection(attributes)
+        )
+        item = response.get("Item")
+        return self._decode([item], consistent)[0] if item is not None else None
+
+    def get_shipping_batch(self, shipping_ids: list, attributes: list = None, consistent: bool = False):
+        # returns {shipping_id: item}; ids that do not exist are left out
+        request = {"ConsistentRead": consistent, **projection(attributes, with_key=True)}
+        shippings = self._batch_get(shipping_ids, request)
+        self._decode(list(shippings.values()), consistent)
+        return shippings
+
+    def _batch_get(self, shipping_ids: list, request: dict):
+        shipping_ids = list(dict.fromkeys(shipping_ids))
+        shippings = {}
+        for start in range(0, len(shipping_ids), BATCH_GET_SIZE):
+            keys = [{"shipping_id": shipping_id} for shipping_id in shipping_ids[start:start + BATCH_GET_SIZE]]
+            attempt = 0
+            while keys:
+                response = self.table.meta.client.batch_get_item(
+                    RequestItems={self.table.name: {"Keys": keys, **request}}
+                )
+                for item in response.get("Responses", {}).get(self.table.name, []):
+                    shippings[item["shipping_id"]] = item
+
+                keys = response.get("UnprocessedKeys", {}).get(self.table.name, {}).get("Keys", [])
+                if keys and attempt >= BATCH_MAX_RETRIES:
+                    raise RuntimeError(f"{len(keys)} shippings were not read after {BATCH_MAX_RETRIES} retries")
+                if keys:
+                    sleep_backoff(attempt)
+                    attempt += 1
+
+        return shippings
+
+    def create_shipping(self, shipping_type: str, product_ids: list, order_id: str, status: str, due_date: datetime,
+                        outbox: bool = False, traceparent: str = None):
+        item, children = build_item(shipping_type, product_ids, order_id, status, due_date, outbox, traceparent)
+        errors = self._put_indexed([(0, child) for child in children])
+        if errors:
+            raise RuntimeError(f"Product ids of shipping {item['shipping_id']} were not written: {errors[0]}")
         self.table.put_item(Item=item)
-        return shipping_id
+        return item["shipping_id"]
+
+    def create_shipping_batch(self, shippings: list):
+        # shippings: dicts of create_shipping kwargs; errors are keyed by input index
+        built = [build_item(**shipping) for shipping in shippings]
+        errors = self._put_indexed(child_entries(built))
+        errors.update(self._put_indexed(shipping_entries(built, errors)))
+        return created_ids(built, errors), errors
+
+    def _put_indexed(self, items: list):
+        # items: (input index, item) pairs; returns {input index: first error}
+        errors = {}
+        for chunk in write_chunks(items):
+            merge_chunk_errors(chunk, self._batch_put([item for _, item in chunk]), errors)
+        return errors
 
     def update_shipping_status(self, shipping_id, status):
         response = self.table.update_item(
@@ -43,3 +205,295 @@ class ShippingRepository:
         )
 
         return response
+
+    def update_shipping_status_batch(self, statuses: dict, expected_status: str = None):
+        # with expected_status, shippings in any other status are reported as errors and left unchanged
+        update = {'UpdateExpression': 'SET shipping_status = :sh_status'}
+        if expected_status is not None:
+            update['ConditionExpression'] = 'attribute_exists(shipping_id) AND shipping_status = :expected'
+
+        return self._transact_updates({
+            shipping_id: {
+                **update,
+                'ExpressionAttributeValues': {
+                    ':sh_status': status,
+                    **({':expected': expected_status} if expected_status is not None else {}),
+                },
+            }
+            for shipping_id, status in statuses.items()
+        })
+
+    def list_shippings_by_status(self, status: str, due_before: datetime = None, page_size: int = 100):
+        # lazily yields index items (shipping_id, shipping_status, due_date), earliest due first
+        condition = Key("shipping_status").eq(status)
+        if due_before is not None:
+            condition = condition & Key("due_date").lt(due_before.astimezone(timezone.utc).isoformat())
+
+        return self._paginate(IndexName=SHIPPING_STATUS_DUE_INDEX, KeyConditionExpression=condition, Limit=page_size)
+
+    def list_outbox(self, limit: int = 100):
+        # shipping ids written with outbox=True that were not relayed yet, oldest first, mapped to the
+        # traceparent they were created under (None outside a span); the index projects traceparent
+        response = self.table.query(
+            IndexName=SHIPPING_OUTBOX_INDEX,
+            KeyConditionExpression=Key("outbox_status").eq(OUTBOX_PENDING),
+            Limit=limit
+        )
+        return {item["shipping_id"]: item.get("traceparent") for item in response.get("Items", [])}
+
+    def clear_outbox_batch(self, shipping_ids: list):
+        return self._transact_updates({
+            shipping_id: {'UpdateExpression': 'REMOVE outbox_status'}
+            for shipping_id in shipping_ids
+        })
+
+    def list_shippings_by_order(self, order_id: str, page_size: int = 100):
+        # lazily yields full shipping items of the order, oldest first, one query page at a time
+        shippings = self._paginate(
+            IndexName=SHIPPING_ORDER_INDEX,
+            KeyConditionExpression=Key("order_id").eq(order_id),
+            Limit=page_size
+        )
+        return (self._decode([shipping])[0] for shipping in shippings)
+
+    def scan_segment(self, segment: int, total_segments: int, start_key: dict = None, page_size: int = 1000):
+        # lazily yields (items, last_key) per page of one parallel scan segment; last_key is None on the last page
+        scan = {"Segment": segment, "TotalSegments": total_segments, "Limit": page_size}
+        if start_key:
+            scan["ExclusiveStartKey"] = start_key
+        while True:
+            response = self.table.scan(**scan)
+            last_key = response.get("LastEvaluatedKey")
+            shippings = [item for item in response.get("Items", []) if not is_chunk(item)]
+            yield self._decode(shippings), last_key
+
+            if last_key is None:
+                return
+            scan["ExclusiveStartKey"] = last_key
+
+    def _paginate(self, **query):
+        while True:
+            response = self.table.query(**query)
+            yield from response.get("Items", [])
+
+            if "LastEvaluatedKey" not in response:
+                return
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _decode(self, shippings: list, consistent: bool = False):
+        # fetches the chunks of every chunked item in one batch
+        keys = chunk_keys(shippings)
+        return decode_shippings(shippings, self._batch_get(keys, {"ConsistentRead": consistent}) if keys else {})
+
+    def _transact_updates(self, updates: dict):
+        # returns (responses, errors), both keyed by shipping id
+        responses = {}
+        errors = {}
+        shipping_ids = list(updates)
+        for start in range(0, len(shipping_ids), TRANSACT_WRITE_SIZE):
+            chunk = shipping_ids[start:start + TRANSACT_WRITE_SIZE]
+            while chunk:
+                try:
+                    response = self.table.meta.client.transact_write_items(TransactItems=[
+                        {
+                            'Update': {
+                                'TableName': self.table.name,
+                                'Key': {'shipping_id': shipping_id},
+                                'ConditionExpression': 'attribute_exists(shipping_id)',
+                                **updates[shipping_id],
+                            }
+                        }
+                        for shipping_id in chunk
+                    ])
+                except ClientError as error:
+                    # drop the items whose condition failed and retry the rest of the chunk
+                    reasons = error.response.get('CancellationReasons', [])
+                    failed = [
+                        shipping_id for shipping_id, reason in zip(chunk, reasons)
+                        if reason.get('Code') == 'ConditionalCheckFailed'
+                    ]
+                    for shipping_id in failed or chunk:
+                        errors[shipping_id] = str(error)
+                    chunk = [shipping_id for shipping_id in chunk if failed and shipping_id not in failed]
+                    continue
+
+                for shipping_id in chunk:
+                    responses[shipping_id] = response
+                chunk = []
+
+        return responses, errors
+
+    def _batch_put(self, items: list):
+        batch = BatchPut(self.table.name, items)
+        while batch.requests:
+            try:
+                response = self.table.meta.client.batch_write_item(RequestItems=batch.request_items())
+            except ClientError as error:
+                batch.fail(str(error))
+                break
+
+            delay = batch.retry_delay(response)
+            if delay is not None:
+                time.sleep(delay)
+
+        return batch.errors
+
+
+class AsyncShippingRepository:
+    """asyncio counterpart of ShippingRepository.
+
+    One aiobotocore client, and so one connection pool, is shared by every
+    coroutine using the repository. Use it as ``async with
+    AsyncShippingRepository() as repository`` or pass an open client.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+        self.table_name = SHIPPING_TABLE_NAME
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+        self._exit_stack = None
+
+    async def __aenter__(self):
+        if self.client is None:
+            self._exit_stack = AsyncExitStack()
+            self.client = await self._exit_stack.enter_async_context(get_aio_client("dynamodb"))
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self.client = None
+
+    async def get_shipping(self, shipping_id, attributes: list = None, consistent: bool = False):
+        response = await self.client.get_item(
+            TableName=self.table_name,
+            Key=self._serialize({"shipping_id": shipping_id}),
+            ConsistentRead=consistent,
+            **projection(attributes)
+        )
+        item = response.get("Item")
+        if item is None:
+            return None
+        return (await self._decode([self._deserialize(item)], consistent))[0]
+
+    async def get_shipping_batch(self, shipping_ids: list, attributes: list = None, consistent: bool = False):
+        request = {"ConsistentRead": consistent, **projection(attributes, with_key=True)}
+        shippings = await self._get_many(shipping_ids, request)
+        await self._decode(list(shippings.values()), consistent)
+        return shippings
+
+    async def create_shipping(self, shipping_type: str, product_ids: list, order_id: str, status: str,
+                              due_date: datetime, outbox: bool = False, traceparent: str = None):
+        item, children = build_item(shipping_type, product_ids, order_id, status, due_date, outbox, traceparent)
+        errors = await self._put_indexed([(0, child) for child in children])
+        if errors:
+            raise RuntimeError(f"Product ids of shipping {item['shipping_id']} were not written: {errors[0]}")
+        await self.client.put_item(TableName=self.table_name, Item=self._serialize(item))
+        return item["shipping_id"]
+
+    async def create_shipping_batch(self, shippings: list):
+        built = [build_item(**shipping) for shipping in shippings]
+        errors = await self._put_indexed(child_entries(built))
+        errors.update(await self._put_indexed(shipping_entries(built, errors)))
+        return created_ids(built, errors), errors
+
+    async def update_shipping_status(self, shipping_id, status):
+        return await self.client.update_item(
+            TableName=self.table_name,
+            Key=self._serialize({"shipping_id": shipping_id}),
+            UpdateExpression='SET shipping_status = :sh_status',
+            ExpressionAttributeValues=self._serialize({':sh_status': status})
+        )
+
+    async def update_shipping_status_batch(self, statuses: dict, expected_status: str = None):
+        # parallel single-item updates, so one failing shipping does not fail its neighbours; with
+        # expected_status, shippings in any other status are reported as errors and left unchanged
+        shipping_ids = list(statuses)
+        results = await asyncio.gather(
+            *(self._update_status(shipping_id, statuses[shipping_id], expected_status) for shipping_id in shipping_ids),
+            return_exceptions=True
+        )
+
+        responses = {}
+        errors = {}
+        for shipping_id, result in zip(shipping_ids, results):
+            if isinstance(result, Exception):
+                errors[shipping_id] = str(result)
+            else:
+                responses[shipping_id] = result
+        return responses, errors
+
+    async def _update_status(self, shipping_id, status, expected_status: str = None):
+        if expected_status is None:
+            return await self.update_shipping_status(shipping_id, status)
+
+        return await self.client.update_item(
+            TableName=self.table_name,
+            Key=self._serialize({"shipping_id": shipping_id}),
+            UpdateExpression='SET shipping_status = :sh_status',
+            ConditionExpression='attribute_exists(shipping_id) AND shipping_status = :expected',
+            ExpressionAttributeValues=self._serialize({':sh_status': status, ':expected': expected_status})
+        )
+
+    async def _get_many(self, shipping_ids: list, request: dict):
+        shipping_ids = list(dict.fromkeys(shipping_ids))
+        chunks = await asyncio.gather(*(
+            self._batch_get(shipping_ids[start:start + BATCH_GET_SIZE], request)
+            for start in range(0, len(shipping_ids), BATCH_GET_SIZE)
+        ))
+        return {shipping_id: item for chunk in chunks for shipping_id, item in chunk.items()}
+
+    async def _put_indexed(self, items: list):
+        # the chunks are written concurrently
+        chunks = write_chunks(items)
+        results = await asyncio.gather(*(self._batch_put([item for _, item in chunk]) for chunk in chunks))
+        errors = {}
+        for chunk, chunk_errors in zip(chunks, results):
+            merge_chunk_errors(chunk, chunk_errors, errors)
+        return errors
+
+    async def _decode(self, shippings: list, consistent: bool = False):
+        keys = chunk_keys(shippings)
+        return decode_shippings(shippings, await self._get_many(keys, {"ConsistentRead": consistent}) if keys else {})
+
+    async def _batch_get(self, shipping_ids: list, request: dict):
+        keys = [self._serialize({"shipping_id": shipping_id}) for shipping_id in shipping_ids]
+        shippings = {}
+        attempt = 0
+        while keys:
+            response = await self.client.batch_get_item(RequestItems={self.table_name: {"Keys": keys, **request}})
+            for item in response.get("Responses", {}).get(self.table_name, []):
+                item = self._deserialize(item)
+                shippings[item["shipping_id"]] = item
+
+            keys = response.get("UnprocessedKeys", {}).get(self.table_name, {}).get("Keys", [])
+            if keys and attempt >= BATCH_MAX_RETRIES:
+                raise RuntimeError(f"{len(keys)} shippings were not read after {BATCH_MAX_RETRIES} retries")
+            if keys:
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+
+        return shippings
+
+    async def _batch_put(self, items: list):
+        batch = BatchPut(self.table_name, items, self._serialize, key=lambda item: item["shipping_id"]["S"])
+        while batch.requests:
+            try:
+                response = await self.client.batch_write_item(RequestItems=batch.request_items())
+            except ClientError as error:
+                batch.fail(str(error))
+                break
+
+            delay = batch.retry_delay(response)
+            if delay is not None:
+                await asyncio.sleep(delay)
+
+        return batch.errors
+
+    def _serialize(self, item: dict):
+        return {key: self._serializer.serialize(value) for key, value in item.items()}
+
+    def _deserialize(self, item: dict):
+        return {key: self._deserializer.deserialize(value) for key, value in item.items()}
@@ -0,0 +1,147 @@
+import asyncio
+import random
+import threading
+import time
+
+from .config import (
+    BATCH_MAX_RETRIES, BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS, RATE_LIMIT_INITIAL_RPS, RATE_LIMIT_MIN_RPS,
+    RATE_LIMIT_MAX_RPS, RATE_LIMIT_BURST, RATE_LIMIT_INCREASE_RPS
+)
+from .metrics import REGISTRY
+
+# error codes AWS services use to say a request was rejected because of its rate
+THROTTLE_CODES = frozenset({
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException",
+    "TooManyRequestsException", "ProvisionedThroughputExceededException", "RequestLimitExceeded",
+    "RequestThrottled", "SlowDown", "LimitExceededException",
+})
+
+
+def backoff_delay(attempt: int) -> float:
+    # "full jitter": a random delay up to the capped exponential one, so clients retrying after the
+    # same throttle do not come back in lockstep
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def sleep_backoff(attempt: int):
+    time.sleep(backoff_delay(attempt))
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate adapts to throttling (additive increase, multiplicative decrease).
+
+    Every request takes a token; tokens refill at ``rate`` per second up to
+    ``burst``. A throttle halves the rate, at most once per ``cooldown``
+    seconds, and empties the bucket; every success adds
+    ``increase / rate``, so the rate grows by about ``increase`` per second
+    while the service keeps up.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT_INITIAL_RPS, burst: float = RATE_LIMIT_BURST,
+                 min_rate: float = RATE_LIMIT_MIN_RPS, max_rate: float = RATE_LIMIT_MAX_RPS,
+                 increase: float = RATE_LIMIT_INCREASE_RPS, decrease: float = 0.5, cooldown: float = 0.1,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.clock = clock
+        self.throttles = 0
+        self._tokens = burst
+        self._updated = clock()
+        self._decreased = None
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # takes a token now and returns how long to wait before using it; callers queue up in debt
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self) -> float:
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = self.clock()
+            if self._decreased is not None and now - self._decreased < self.cooldown:
+                return
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+            self._decreased = now
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service: str):
+    # one limiter per AWS service, shared by every client of the process, sync and async alike
+    with _limiters_lock:
+        if service not in _limiters:
+            _limiters[service] = AdaptiveRateLimiter()
+        return _limiters[service]
+
+
+def install_rate_limiting(events, asynchronous: bool = False):
+    """Register the shared limiters on a botocore event emitter.
+
+    Every attempt, botocore's own retries included, waits for a token of
+    its service before it is sent; throttling errors and partially
+    unprocessed batches slow the service's limiter down and are counted in
+    the metrics registry.
+    """
+    def before_send(event_name, **kwargs):
+        _, service, operation = event_name.split(".", 2)
+        _record_wait(service, operation, get_limiter(service).acquire())
+
+    async def before_send_async(event_name, **kwargs):
+        _, service, operation = event_name.split(".", 2)
+        _record_wait(service, operation, await get_limiter(service).acquire_async())
+
+    def needs_retry(event_name, response=None, **kwargs):
+        _, service, operation = event_name.split(".", 2)
+        if response is None:
+            return
+        http_response, parsed = response
+        limiter = get_limiter(service)
+        if parsed.get("Error", {}).get("Code") in THROTTLE_CODES or parsed.get("UnprocessedItems") \
+                or parsed.get("UnprocessedKeys"):
+            limiter.on_throttle()
+            REGISTRY.add(service, operation, throttles=1)
+        elif http_response.status_code < 300:
+            limiter.on_success()
+        REGISTRY.set_gauge("rate_limit_rps", service, limiter.rate)
+
+    events.register("before-send", before_send_async if asynchronous else before_send,
+                    unique_id="rate-limit-before-send")
+    events.register("needs-retry", needs_retry, unique_id="rate-limit-needs-retry")
+
+
+def _record_wait(service: str, operation: str, delay: float):
+    if delay:
+        REGISTRY.add(service, operation, rate_limit_wait_seconds=delay)
@@ -1,54 +1,305 @@
 from services.repository import ShippingRepository
 from services.publisher import ShippingPublisher
+from services.tracing import current_span, start_span, record_span
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
+import logging
+import math
+import time
 
+logger = logging.getLogger(__name__)
+
+
+class ShippingRulesMixin:
+    """Validation and batch bookkeeping shared by ShippingService and AsyncShippingService.
+
+    Only plain functions of the request data live here, so the sync and
+    async services can share them without one passing for the other.
+    """
 
-class ShippingService:
     SHIPPING_CREATED: str = 'created'
     SHIPPING_IN_PROGRESS: str = 'in progress'
     SHIPPING_COMPLETED: str = 'completed'
     SHIPPING_FAILED: str = 'failed'
 
-    def __init__(self, repository, publisher):
-        self.repository = repository
-        self.publisher = publisher
-
     @staticmethod
     def list_available_shipping_type():
         return ['Нова Пошта', 'Укр Пошта', 'Meest Express', 'Самовивіз']
 
-    def create_shipping(self, shipping_type, product_ids, order_id, due_date):
+    def validate_shipping(self, shipping_type, due_date):
         if shipping_type not in self.list_available_shipping_type():
             raise ValueError("Shipping type is not available")
 
         if due_date <= datetime.now(timezone.utc):
             raise ValueError("Shipping due datetime must be greater than datetime now")
 
-        shipping_id = self.repository.create_shipping(shipping_type, product_ids, order_id, self.SHIPPING_CREATED, due_date)
+    def _prepare_shippings(self, requests):
+        span = current_span()
+        errors = {}
+        indexes = []
+        shippings = []
+        for index, request in enumerate(requests):
+            try:
+                self.validate_shipping(request['shipping_type'], request['due_date'])
+            except ValueError as error:
+                errors[index] = str(error)
+                continue
 
-        self.publisher.send_new_shipping(shipping_id)
-        self.repository.update_shipping_status(shipping_id, self.SHIPPING_IN_PROGRESS)
+            indexes.append(index)
+            shippings.append({
+                'shipping_type': request['shipping_type'],
+                'product_ids': request['product_ids'],
+                'order_id': request['order_id'],
+                'status': self.SHIPPING_IN_PROGRESS if self.use_outbox else self.SHIPPING_CREATED,
+                'due_date': request['due_date'],
+                'outbox': self.use_outbox,
+                'traceparent': span.traceparent if self.use_outbox and span is not None else None,
+            })
 
-        return shipping_id
+        return errors, indexes, shippings
+
+    @staticmethod
+    def _collect_created(indexes, created_ids, create_errors, shipping_ids, errors):
+        created = {}
+        for position, index in enumerate(indexes):
+            if position in create_errors:
+                errors[index] = create_errors[position]
+                continue
+
+            shipping_ids[index] = created_ids[position]
+            created[created_ids[position]] = index
 
-    def process_shipping_batch(self):
+        return created
+
+    @staticmethod
+    def _collect_published(created, publish_errors, shipping_ids, errors):
+        # an unsent shipping is marked failed and reported by its error alone: every position has
+        # either an id or an error, never both
+        published = {}
+        for position, (shipping_id, index) in enumerate(created.items()):
+            if position in publish_errors:
+                shipping_ids[index] = None
+                errors[index] = publish_errors[position]
+                continue
+            published[shipping_id] = index
+
+        return published
+
+    def _statuses_after_publish(self, created, published):
+        # published shippings move on to in progress; the ones whose message was not sent are marked
+        # failed, so no 'created' row is left behind for a request reported as failed
+        return {
+            shipping_id: self.SHIPPING_IN_PROGRESS if shipping_id in published else self.SHIPPING_FAILED
+            for shipping_id in created
+        }
+
+    @staticmethod
+    def _log_status_errors(update_errors):
+        # not an error of the request: a published shipping is still completed by the consumer
+        for shipping_id, error in update_errors.items():
+            logger.warning("Failed to update the status of shipping %s after publishing: %s", shipping_id, error)
+
+    @staticmethod
+    def _batch_result(shipping_ids, responses, errors):
+        # ResponseMetadata per polled id, None when the write failed, {} for unknown ids
         result = []
-        shipping = self.publisher.poll_shipping()
-        for shipping_id in shipping:
-            shipping = self.process_shipping(shipping_id)
-            result.append(shipping)
+        for shipping_id in shipping_ids:
+            if shipping_id in responses:
+                result.append(responses[shipping_id]['ResponseMetadata'])
+            elif shipping_id in errors:
+                result.append(None)
+            else:
+                result.append({})
 
         return result
 
-    def process_shipping(self, shipping_id):
-        shipping = self.repository.get_shipping(shipping_id)
-        if datetime.fromisoformat(shipping['due_date']) < datetime.now(timezone.utc):
-            return self.fail_shipping(shipping_id)
+    def _next_statuses(self, shippings):
+        now = datetime.now(timezone.utc)
+        return {
+            shipping_id: self.next_shipping_status(shipping, now)
+            for shipping_id, shipping in shippings.items()
+        }
+
+    def next_shipping_status(self, shipping, now):
+        if datetime.fromisoformat(shipping['due_date']) < now:
+            return self.SHIPPING_FAILED
+
+        return self.SHIPPING_COMPLETED
+
+
+class ShippingService(ShippingRulesMixin):
+    def __init__(self, repository, publisher, use_outbox=False, max_workers=None, item_timeout=None):
+        self.repository = repository
+        self.publisher = publisher
+        self.use_outbox = use_outbox
+        self.max_workers = max_workers
+        self.item_timeout = item_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shipping") \
+            if max_workers else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # waits for writes still running in the executor, timed out ones included
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def create_shipping(self, shipping_type, product_ids, order_id, due_date):
+        with start_span("shipping.create", {"order_id": order_id, "shipping_type": shipping_type}) as span:
+            self.validate_shipping(shipping_type, due_date)
+
+            if self.use_outbox:
+                # single write; ShippingOutboxRelay publishes it to the queue
+                shipping_id = self.repository.create_shipping(
+                    shipping_type, product_ids, order_id, self.SHIPPING_IN_PROGRESS, due_date, outbox=True,
+                    traceparent=span.traceparent
+                )
+                span.set_attribute("shipping_id", shipping_id)
+                return shipping_id
+
+            shipping_id = self.repository.create_shipping(
+                shipping_type, product_ids, order_id, self.SHIPPING_CREATED, due_date
+            )
+            span.set_attribute("shipping_id", shipping_id)
+
+            # the message carries this span's trace context to the consumer
+            self.publisher.send_new_shipping(shipping_id)
+            self.repository.update_shipping_status(shipping_id, self.SHIPPING_IN_PROGRESS)
+
+            return shipping_id
+
+    def create_shippings(self, requests):
+        with start_span("shipping.create_batch") as span:
+            shipping_ids, errors = self._create_shippings(list(requests))
+            span.set_attribute("created", len(shipping_ids) - len(errors))
+            span.set_attribute("failed", len(errors))
+            return shipping_ids, errors
+
+    def _create_shippings(self, requests):
+        shipping_ids = [None] * len(requests)
+        errors, indexes, shippings = self._prepare_shippings(requests)
+
+        created_ids, create_errors = self.repository.create_shipping_batch(shippings)
+        created = self._collect_created(indexes, created_ids, create_errors, shipping_ids, errors)
+        if self.use_outbox:
+            return shipping_ids, errors
+
+        _, publish_errors = self.publisher.send_new_shipping_batch(list(created))
+        published = self._collect_published(created, publish_errors, shipping_ids, errors)
+
+        try:
+            _, update_errors = self.repository.update_shipping_status_batch(
+                self._statuses_after_publish(created, published)
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            # the messages are already sent, so raising would make callers undo orders that still ship
+            logger.exception("Failed to update the status of %d shippings after publishing", len(created))
+        else:
+            self._log_status_errors(update_errors)
+
+        return shipping_ids, errors
+
+    def process_shipping_batch(self, shipping_ids=None, parents=None):
+        # parents: trace context each shipping was sent with (see tracing.message_context), or None
+        started = time.time()
+        if shipping_ids is None:
+            shipping_ids = self.publisher.poll_shipping()
+        shippings = self.repository.get_shipping_batch(shipping_ids, attributes=['due_date'])
 
-        return self.complete_shipping(shipping_id)
+        statuses = self._next_statuses(shippings)
+        if self.executor is not None:
+            responses, errors = self._update_statuses_concurrently(statuses)
+        else:
+            responses, errors = self.repository.update_shipping_status_batch(statuses)
+
+        if parents is not None:
+            finished = time.time()
+            for shipping_id, parent in zip(shipping_ids, parents):
+                attributes = {"shipping_id": shipping_id, "shipping_status": statuses.get(shipping_id),
+                              "batch_size": len(shipping_ids)}
+                if shipping_id in errors:
+                    attributes["error"] = errors[shipping_id]
+                record_span("shipping.process", parent, started, finished, attributes)
+
+        return self._batch_result(shipping_ids, responses, errors)
+
+    def _update_statuses_concurrently(self, statuses):
+        # every item gets item_timeout from the moment a worker picks it up. A running write cannot be
+        # cancelled and may still land after it timed out; it is reported as None, so the consumer keeps
+        # the message and the same status is written again on redelivery. Items still queued when every
+        # worker could have used its item_timeout are cancelled before they write anything.
+        started = {}
+
+        def update(shipping_id, status):
+            started[shipping_id] = time.monotonic()
+            return self.repository.update_shipping_status(shipping_id, status)
+
+        futures = {
+            self.executor.submit(update, shipping_id, status): shipping_id
+            for shipping_id, status in statuses.items()
+        }
+        queue_deadline = None
+        if self.item_timeout is not None:
+            queue_deadline = time.monotonic() + self.item_timeout * math.ceil(len(futures) / self.max_workers)
+
+        responses = {}
+        errors = {}
+        pending = set(futures)
+        while pending:
+            timeout = None
+            if self.item_timeout is not None:
+                deadlines = [self._item_deadline(futures[future], started, queue_deadline) for future in pending]
+                timeout = max(0.0, min(deadlines) - time.monotonic())
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                shipping_id = futures[future]
+                try:
+                    responses[shipping_id] = future.result()
+                except Exception as error:
+                    errors[shipping_id] = str(error)
+
+            if self.item_timeout is not None:
+                pending = self._expire(pending, futures, started, queue_deadline, errors)
+
+        return responses, errors
+
+    def _item_deadline(self, shipping_id, started, queue_deadline):
+        return started[shipping_id] + self.item_timeout if shipping_id in started else queue_deadline
+
+    def _expire(self, pending, futures, started, queue_deadline, errors):
+        # reports running items past their deadline and cancels queued ones; returns the items left to wait for
+        now = time.monotonic()
+        remaining = set()
+        for future in pending:
+            shipping_id = futures[future]
+            if now < self._item_deadline(shipping_id, started, queue_deadline):
+                remaining.add(future)
+            elif shipping_id in started:
+                errors[shipping_id] = f"Timed out after {self.item_timeout} seconds"
+            elif future.cancel():
+                errors[shipping_id] = f"Not started within {self.item_timeout} seconds per batch round"
+            else:
+                # picked up by a worker right now, its own deadline starts with the next round
+                remaining.add(future)
+        return remaining
+
+    def process_shipping(self, shipping_id, parent=None):
+        with start_span("shipping.process", {"shipping_id": shipping_id}, parent=parent) as span:
+            shipping = self.repository.get_shipping(shipping_id, attributes=['due_date'])
+            if self.next_shipping_status(shipping, datetime.now(timezone.utc)) == self.SHIPPING_FAILED:
+                span.set_attribute("shipping_status", self.SHIPPING_FAILED)
+                return self.fail_shipping(shipping_id)
+
+            span.set_attribute("shipping_status", self.SHIPPING_COMPLETED)
+            return self.complete_shipping(shipping_id)
 
     def check_status(self, shipping_id):
-        shipping = self.repository.get_shipping(shipping_id)
+        shipping = self.repository.get_shipping(shipping_id, attributes=['shipping_status'])
 
         return shipping['shipping_status']
 
@@ -59,3 +310,82 @@ class ShippingService:
     def complete_shipping(self, shipping_id):
         response = self.repository.update_shipping_status(shipping_id, self.SHIPPING_COMPLETED)
         return response['ResponseMetadata']
+
+
+class AsyncShippingService(ShippingRulesMixin):
+    """asyncio version of ShippingService for AsyncShippingRepository and AsyncShippingPublisher."""
+
+    def __init__(self, repository, publisher, use_outbox=False):
+        self.repository = repository
+        self.publisher = publisher
+        self.use_outbox = use_outbox
+
+    async def create_shipping(self, shipping_type, product_ids, order_id, due_date):
+        self.validate_shipping(shipping_type, due_date)
+
+        if self.use_outbox:
+            return await self.repository.create_shipping(
+                shipping_type, product_ids, order_id, self.SHIPPING_IN_PROGRESS, due_date, outbox=True
+            )
+
+        shipping_id = await self.repository.create_shipping(
+            shipping_type, product_ids, order_id, self.SHIPPING_CREATED, due_date
+        )
+
+        await self.publisher.send_new_shipping(shipping_id)
+        await self.repository.update_shipping_status(shipping_id, self.SHIPPING_IN_PROGRESS)
+
+        return shipping_id
+
+    async def create_shippings(self, requests):
+        requests = list(requests)
+        shipping_ids = [None] * len(requests)
+        errors, indexes, shippings = self._prepare_shippings(requests)
+
+        created_ids, create_errors = await self.repository.create_shipping_batch(shippings)
+        created = self._collect_created(indexes, created_ids, create_errors, shipping_ids, errors)
+        if self.use_outbox:
+            return shipping_ids, errors
+
+        _, publish_errors = await self.publisher.send_new_shipping_batch(list(created))
+        published = self._collect_published(created, publish_errors, shipping_ids, errors)
+
+        try:
+            _, update_errors = await self.repository.update_shipping_status_batch(
+                self._statuses_after_publish(created, published)
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            # the messages are already sent, so raising would make callers undo orders that still ship
+            logger.exception("Failed to update the status of %d shippings after publishing", len(created))
+        else:
+            self._log_status_errors(update_errors)
+
+        return shipping_ids, errors
+
+    async def process_shipping_batch(self, shipping_ids=None):
+        if shipping_ids is None:
+            shipping_ids = await self.publisher.poll_shipping()
+        shippings = await self.repository.get_shipping_batch(shipping_ids, attributes=['due_date'])
+
+        responses, errors = await self.repository.update_shipping_status_batch(self._next_statuses(shippings))
+        return self._batch_result(shipping_ids, responses, errors)
+
+    async def process_shipping(self, shipping_id):
+        shipping = await self.repository.get_shipping(shipping_id, attributes=['due_date'])
+        if self.next_shipping_status(shipping, datetime.now(timezone.utc)) == self.SHIPPING_FAILED:
+            return await self.fail_shipping(shipping_id)
+
+        return await self.complete_shipping(shipping_id)
+
+    async def check_status(self, shipping_id):
+        shipping = await self.repository.get_shipping(shipping_id, attributes=['shipping_status'])
+
+        return shipping['shipping_status']
+
+    async def fail_shipping(self, shipping_id):
+        response = await self.repository.update_shipping_status(shipping_id, self.SHIPPING_FAILED)
+        return response['ResponseMetadata']
+
+    async def complete_shipping(self, shipping_id):
+        response = await self.repository.update_shipping_status(shipping_id, self.SHIPPING_COMPLETED)
+        return response['ResponseMetadata']
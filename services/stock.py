@@ -0,0 +1,135 @@
+import random
+
+from boto3.dynamodb.conditions import Key  # type: ignore
+from botocore.exceptions import ClientError  # type: ignore
+
+from .config import STOCK_TABLE_NAME, STOCK_SHARDS
+from .db import LocalTable
+
+CROSS_SHARD_ATTEMPTS = 3
+
+
+class DynamoShardedStock:
+    """Stock of one SKU split across ``shards`` items of StockTable.
+
+    Each shard is decremented with a conditional atomic ``ADD``, so
+    concurrent buyers only conflict when they hit the same shard. Requests
+    that no single shard can serve are taken across shards in one
+    transaction, after which the shards are rebalanced.
+    """
+
+    def __init__(self, sku: str, shards: int = STOCK_SHARDS):
+        self.sku = sku
+        self.shards = shards
+        self._table = LocalTable(STOCK_TABLE_NAME)
+
+    @property
+    def table(self):
+        return self._table.get()
+
+    @property
+    def total(self):
+        return sum(self.read_shards().values())
+
+    def read_shards(self):
+        response = self.table.query(KeyConditionExpression=Key("sku").eq(self.sku), ConsistentRead=True)
+        return {int(item["shard"]): int(item["available"]) for item in response.get("Items", [])}
+
+    def reset(self, available_amount: int):
+        base, extra = divmod(available_amount, self.shards)
+        with self.table.batch_writer() as batch:
+            for shard in range(self.shards):
+                batch.put_item(Item={"sku": self.sku, "shard": shard, "available": base + (1 if shard < extra else 0)})
+
+    def take(self, requested_amount: int):
+        start = random.randrange(self.shards)
+        for offset in range(self.shards):
+            if self._add((start + offset) % self.shards, -requested_amount):
+                return True
+
+        for _ in range(CROSS_SHARD_ATTEMPTS):
+            taken = self._take_across_shards(requested_amount)
+            if taken is not None:
+                break
+        if not taken:
+            return False
+
+        self.rebalance()
+        return True
+
+    def restore(self, amount: int):
+        self._add(random.randrange(self.shards), amount)
+
+    def rebalance(self):
+        # best effort: the transaction is dropped if any shard changed since it was read
+        counts = self.read_shards()
+        base, extra = divmod(sum(counts.values()), self.shards)
+        try:
+            self.table.meta.client.transact_write_items(TransactItems=[
+                self._set_shard(shard, counts.get(shard, 0), base + (1 if shard < extra else 0))
+                for shard in range(self.shards)
+            ])
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            return False
+        return True
+
+    def _add(self, shard: int, amount: int):
+        update = {
+            "Key": {"sku": self.sku, "shard": shard},
+            "UpdateExpression": "ADD available :amount",
+            "ExpressionAttributeValues": {":amount": amount},
+        }
+        if amount < 0:
+            update["ConditionExpression"] = "available >= :needed"
+            update["ExpressionAttributeValues"][":needed"] = -amount
+
+        try:
+            self.table.update_item(**update)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+        return True
+
+    def _take_across_shards(self, requested_amount: int):
+        # True when taken, False when there is not enough stock, None when shards changed meanwhile
+        counts = self.read_shards()
+        if sum(counts.values()) < requested_amount:
+            return False
+
+        actions = []
+        remaining = requested_amount
+        for shard, available in sorted(counts.items(), key=lambda count: -count[1]):
+            if remaining == 0:
+                break
+            part = min(available, remaining)
+            remaining -= part
+            actions.append({
+                "Update": {
+                    "TableName": self.table.name,
+                    "Key": {"sku": self.sku, "shard": shard},
+                    "UpdateExpression": "ADD available :amount",
+                    "ConditionExpression": "available >= :needed",
+                    "ExpressionAttributeValues": {":amount": -part, ":needed": part},
+                }
+            })
+
+        try:
+            self.table.meta.client.transact_write_items(TransactItems=actions)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            return None
+        return True
+
+    def _set_shard(self, shard: int, expected: int, available: int):
+        return {
+            "Put": {
+                "TableName": self.table.name,
+                "Item": {"sku": self.sku, "shard": shard, "available": available},
+                "ConditionExpression": "attribute_not_exists(sku) OR available = :expected",
+                "ExpressionAttributeValues": {":expected": expected},
+            }
+        }
@@ -0,0 +1,85 @@
+import heapq
+import threading
+from datetime import datetime, timedelta, timezone
+
+from .config import SWEEPER_HORIZON_SECONDS
+from .service import ShippingService
+
+SWEEP_BATCH_SIZE = 25
+
+
+class ShippingExpirySweeper:
+    """Marks in-progress shippings as failed as soon as their due date passes.
+
+    Shippings due within ``horizon`` seconds are loaded from the
+    status/due-date index into a heap ordered by due date; the sweeper
+    sleeps until the earliest one expires and fails everything that is due
+    in conditional batches, so shippings completed meanwhile are left alone.
+    """
+
+    def __init__(self, repository, horizon: float = SWEEPER_HORIZON_SECONDS,
+                 batch_size: int = SWEEP_BATCH_SIZE):
+        self.repository = repository
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self._heap = []
+        self._tracked = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def track(self, shipping_id, due_date: datetime):
+        with self._lock:
+            if shipping_id not in self._tracked:
+                self._tracked.add(shipping_id)
+                heapq.heappush(self._heap, (due_date, shipping_id))
+
+    def load(self, now: datetime = None):
+        now = now or datetime.now(timezone.utc)
+        shippings = self.repository.list_shippings_by_status(
+            ShippingService.SHIPPING_IN_PROGRESS, due_before=now + timedelta(seconds=self.horizon)
+        )
+        for shipping in shippings:
+            self.track(shipping["shipping_id"], datetime.fromisoformat(shipping["due_date"]))
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def sweep(self, now: datetime = None):
+        now = now or datetime.now(timezone.utc)
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] < now:
+                _, shipping_id = heapq.heappop(self._heap)
+                self._tracked.discard(shipping_id)
+                expired.append(shipping_id)
+
+        failed = []
+        for start in range(0, len(expired), self.batch_size):
+            statuses = {
+                shipping_id: ShippingService.SHIPPING_FAILED
+                for shipping_id in expired[start:start + self.batch_size]
+            }
+            responses, _ = self.repository.update_shipping_status_batch(
+                statuses, expected_status=ShippingService.SHIPPING_IN_PROGRESS
+            )
+            failed.extend(responses)
+
+        return failed
+
+    def run(self):
+        self._stop.clear()
+        reload_at = datetime.min.replace(tzinfo=timezone.utc)
+        while not self._stop.is_set():
+            now = datetime.now(timezone.utc)
+            if now >= reload_at:
+                self.load(now)
+                reload_at = now + timedelta(seconds=self.horizon / 2)
+
+            self.sweep(now)
+            next_due = self.next_due()
+            wake_at = reload_at if next_due is None else min(next_due, reload_at)
+            self._stop.wait(max(0.0, (wake_at - datetime.now(timezone.utc)).total_seconds()))
+
+    def stop(self):
+        self._stop.set()
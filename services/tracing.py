@@ -0,0 +1,185 @@
+import atexit
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from .config import TRACE_EXPORT_PATH
+
+# W3C trace context, https://www.w3.org/TR/trace-context/#traceparent-header
+TRACEPARENT = "traceparent"
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class SpanContext:
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+class Span(SpanContext):
+    def __init__(self, name: str, parent: SpanContext = None, attributes: dict = None, start: float = None):
+        super().__init__(parent.trace_id if parent is not None else os.urandom(16).hex(), os.urandom(8).hex())
+        self.name = name
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def finish(self, end: float = None):
+        self.end = time.time() if end is None else end
+        if _exporter is not None:
+            _exporter.export(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.end - self.start if self.end is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class JsonlSpanExporter:
+    """Appends finished spans as JSON lines to a local collector file.
+
+    ``export`` only queues the line; a background thread keeps the file
+    open and writes the queued lines, flushing whenever the queue is
+    empty. ``close`` writes what is left and closes the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def export(self, span: Span):
+        self._queue.put(json.dumps(span.to_dict(), default=str) + "\n")
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write, name="span-exporter", daemon=True)
+                    self._writer.start()
+
+    def close(self):
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._queue.put(None)
+                writer.join()
+
+    def _write(self):
+        with open(self.path, "a") as file:
+            while True:
+                line = self._queue.get()
+                if line is None:
+                    return
+                file.write(line)
+                if self._queue.empty():
+                    file.flush()
+
+
+_exporter = JsonlSpanExporter(TRACE_EXPORT_PATH) if TRACE_EXPORT_PATH else None
+if _exporter is not None:
+    atexit.register(_exporter.close)
+
+
+def set_exporter(exporter):
+    # returns the previous exporter; None drops finished spans
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def start_span(name: str, attributes: dict = None, parent: SpanContext = None):
+    """Run the block in a new span, a child of ``parent`` or of the current span."""
+    span = Span(name, parent if parent is not None else _current.get(), attributes)
+    token = _current.set(span)
+    try:
+        yield span
+    except Exception as error:
+        span.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        _current.reset(token)
+        span.finish()
+
+
+def record_span(name: str, parent: SpanContext, start: float, end: float, attributes: dict = None):
+    """Export a span whose start and end were measured elsewhere, such as time spent in the queue."""
+    span = Span(name, parent, attributes, start=start)
+    span.finish(end)
+    return span
+
+
+def parse_traceparent(value: str):
+    # returns None for a missing or malformed header, so a bad message starts a new trace
+    parts = value.split("-") if value else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return SpanContext(parts[1], parts[2])
+
+
+def message_attributes(traceparent: str = None):
+    """SQS MessageAttributes carrying ``traceparent`` or the current span, empty when there is neither."""
+    if traceparent is None:
+        span = _current.get()
+        if span is None:
+            return {}
+        traceparent = span.traceparent
+    return {TRACEPARENT: {"DataType": "String", "StringValue": traceparent}}
+
+
+def message_context(message: dict):
+    """Return the SpanContext an SQS message was sent from, or None."""
+    attribute = message.get("MessageAttributes", {}).get(TRACEPARENT, {})
+    return parse_traceparent(attribute.get("StringValue"))
+
+
+def read_spans(path: str):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def shipment_latencies(spans: list):
+    """Return {shipping_id: {"queue_dwell_seconds", "order_to_fulfilment_seconds"}} from exported spans.
+
+    Order-to-fulfilment runs from the start of the trace's root span, such
+    as ``order.place_order``, to the end of the shipment's processing.
+    """
+    roots = {}
+    for span in spans:
+        if span["parent_id"] is None:
+            roots[span["trace_id"]] = min(span["start"], roots.get(span["trace_id"], span["start"]))
+
+    latencies = {}
+    for span in spans:
+        shipping_id = span["attributes"].get("shipping_id")
+        if span["name"] == "shipping.queue":
+            latencies.setdefault(shipping_id, {})["queue_dwell_seconds"] = span["duration"]
+        elif span["name"] == "shipping.process" and span["trace_id"] in roots:
+            latencies.setdefault(shipping_id, {})["order_to_fulfilment_seconds"] = \
+                span["end"] - roots[span["trace_id"]]
+    return latencies
@@ -9,7 +9,19 @@ load_dotenv()
 print("AWS Access Key ID:", os.getenv("AWS_ACCESS_KEY_ID"))
 print("AWS Secret Access Key:", os.getenv("AWS_SECRET_ACCESS_KEY"))
 
-@pytest.fixture(scope="session", autouse=True)
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "offline: uses only the in-memory backend or mocks, runs without LocalStack")
+
+
+@pytest.fixture(autouse=True)
+def localstack(request):
+    # every test not marked offline needs the LocalStack tables and queue
+    if request.node.get_closest_marker("offline") is None:
+        request.getfixturevalue("setup_localstack_resources")
+
+
+@pytest.fixture(scope="session")
 def setup_localstack_resources():
     dynamo_client = boto3.client(
         "dynamodb",
@@ -21,10 +33,53 @@ def setup_localstack_resources():
         dynamo_client.create_table(
             TableName=SHIPPING_TABLE_NAME,
             KeySchema=[{"AttributeName": "shipping_id", "KeyType": "HASH"}],
-            AttributeDefinitions=[{"AttributeName": "shipping_id", "AttributeType": "S"}],
+            AttributeDefinitions=[
+                {"AttributeName": "shipping_id", "AttributeType": "S"},
+                {"AttributeName": "outbox_status", "AttributeType": "S"},
+                {"AttributeName": "created_date", "AttributeType": "S"},
+                {"AttributeName": "shipping_status", "AttributeType": "S"},
+                {"AttributeName": "due_date", "AttributeType": "S"},
+                {"AttributeName": "order_id", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[{
+                "IndexName": SHIPPING_OUTBOX_INDEX,
+                "KeySchema": [
+                    {"AttributeName": "outbox_status", "KeyType": "HASH"},
+                    {"AttributeName": "created_date", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "INCLUDE", "NonKeyAttributes": ["traceparent"]},
+            }, {
+                "IndexName": SHIPPING_STATUS_DUE_INDEX,
+                "KeySchema": [
+                    {"AttributeName": "shipping_status", "KeyType": "HASH"},
+                    {"AttributeName": "due_date", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+            }, {
+                "IndexName": SHIPPING_ORDER_INDEX,
+                "KeySchema": [
+                    {"AttributeName": "order_id", "KeyType": "HASH"},
+                    {"AttributeName": "created_date", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }],
             BillingMode="PAY_PER_REQUEST",
         )
         dynamo_client.get_waiter("table_exists").wait(TableName=SHIPPING_TABLE_NAME)
+    if STOCK_TABLE_NAME not in existing_tables:
+        dynamo_client.create_table(
+            TableName=STOCK_TABLE_NAME,
+            KeySchema=[
+                {"AttributeName": "sku", "KeyType": "HASH"},
+                {"AttributeName": "shard", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "sku", "AttributeType": "S"},
+                {"AttributeName": "shard", "AttributeType": "N"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        dynamo_client.get_waiter("table_exists").wait(TableName=STOCK_TABLE_NAME)
     sqs_client = boto3.client(
         "sqs",
         endpoint_url=AWS_ENDPOINT_URL, region_name=AWS_REGION
@@ -35,6 +90,7 @@ def setup_localstack_resources():
     yield  # Всі тести йдуть тут
 
     dynamo_client.delete_table(TableName=SHIPPING_TABLE_NAME)
+    dynamo_client.delete_table(TableName=STOCK_TABLE_NAME)
     sqs_client.delete_queue(QueueUrl=queue_url)
 
 
@@ -1,12 +1,36 @@
+import asyncio
+import builtins
+import gzip
+import json
 import uuid
 import boto3
 import random
-from app.eshop import Product, ShoppingCart, Order
-from services import ShippingService
-from services.repository import ShippingRepository
-from services.publisher import ShippingPublisher
+import threading
+import time
+from app.eshop import (
+    Product, ShoppingCart, Order, Inventory, StockReservations, ShardedProduct, place_orders
+)
+from app.pricing import price_carts
+from benchmarks.harness import compare, measure
+from services import ShippingService, AsyncShippingService
+from services.repository import ShippingRepository, AsyncShippingRepository
+from services.publisher import ShippingPublisher, BufferedShippingPublisher, AsyncShippingPublisher
+from services.outbox import ShippingOutboxRelay
+from services.consumer import ShippingConsumer
+from services.cache import CachedShippingRepository, TTLCache
+from services.stock import DynamoShardedStock
+from services.sweeper import ShippingExpirySweeper
+from services.export import ShippingExporter
+from services.metrics import REGISTRY
+from services.retry import AdaptiveRateLimiter, get_limiter, install_rate_limiting
+from services.tracing import JsonlSpanExporter, Span, read_spans, set_exporter, shipment_latencies
+from services.memory import MemoryQueue, MemoryShippingPublisher, MemoryShippingRepository, MemoryTable
 from datetime import datetime, timedelta, timezone
-from services.config import AWS_ENDPOINT_URL, AWS_REGION, SHIPPING_QUEUE
+from decimal import Decimal
+from unittest.mock import ANY
+from services.config import AWS_ENDPOINT_URL, AWS_REGION, SHIPPING_QUEUE, SHIPPING_TABLE_NAME, RATE_LIMIT_INITIAL_RPS
+from botocore.exceptions import EndpointConnectionError
+from botocore.hooks import HierarchicalEmitter
 import pytest
 
 
@@ -16,6 +40,7 @@ import pytest
     (8662354, 123456),
     (str(uuid.uuid4()), str(uuid.uuid4()))
 ])
+@pytest.mark.offline
 def test_place_order_with_mocked_repo(mocker, order_id, shipping_id):
     mock_repo = mocker.Mock()
     mock_publisher = mocker.Mock()
@@ -164,6 +189,7 @@ def test_cancel_order():
 
     assert order.status == "cancelled", "Order status must be 'cancelled'"
 
+@pytest.mark.offline
 def test_remove_product_from_cart():
     """Ensure that a product can be removed from the cart"""
     cart = ShoppingCart()
@@ -174,6 +200,7 @@ def test_remove_product_from_cart():
     assert len(cart.products) == 0, "Cart should be empty after removing the product"
 
 
+@pytest.mark.offline
 def test_order_total_price():
     """Ensure the total price of the order is calculated correctly"""
     cart = ShoppingCart()
@@ -221,3 +248,981 @@ def test_product_stock_updates_after_purchase():
     order.place_order(ShippingService.list_available_shipping_type()[0], due_date=datetime.now(timezone.utc) + timedelta(days=1))
 
     assert product.available_amount == initial_stock - purchase_amount, "Product stock should decrease after purchase"
+
+@pytest.mark.offline
+def test_create_shippings_reports_errors_in_input_order(mocker):
+    """Ensure bulk creation keeps input order and reports per-item errors"""
+    mock_repo = mocker.Mock()
+    mock_publisher = mocker.Mock()
+    shipping_service = ShippingService(mock_repo, mock_publisher)
+    mock_repo.create_shipping_batch.return_value = (["shipping_1", None], {1: "write failed"})
+    mock_repo.update_shipping_status_batch.return_value = ({}, {})
+    mock_publisher.send_new_shipping_batch.return_value = (["message_1"], {})
+
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    shipping_ids, errors = shipping_service.create_shippings([
+        {"shipping_type": shipping_type, "product_ids": ["A"], "order_id": "order_1", "due_date": due_date},
+        {"shipping_type": "Invalid Type", "product_ids": ["B"], "order_id": "order_2", "due_date": due_date},
+        {"shipping_type": shipping_type, "product_ids": ["C"], "order_id": "order_3", "due_date": due_date},
+    ])
+
+    assert shipping_ids == ["shipping_1", None, None]
+    assert errors == {1: "Shipping type is not available", 2: "write failed"}
+    mock_publisher.send_new_shipping_batch.assert_called_once_with(["shipping_1"])
+    mock_repo.update_shipping_status_batch.assert_called_once_with(
+        {"shipping_1": ShippingService.SHIPPING_IN_PROGRESS}
+    )
+
+
+@pytest.mark.offline
+def test_create_shippings_reports_unpublished_shippings_by_error_only(mocker):
+    """Ensure a shipping whose message was not sent comes back as an error without an id"""
+    mock_repo = mocker.Mock()
+    mock_repo.create_shipping_batch.return_value = (["shipping_1", "shipping_2"], {})
+    mock_repo.update_shipping_status_batch.return_value = ({}, {})
+    mock_publisher = mocker.Mock()
+    mock_publisher.send_new_shipping_batch.return_value = (["message_1", None], {1: "send failed"})
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+
+    shipping_ids, errors = ShippingService(mock_repo, mock_publisher).create_shippings([
+        {"shipping_type": ShippingService.list_available_shipping_type()[0], "product_ids": ["A"],
+         "order_id": f"order_{index}", "due_date": due_date}
+        for index in range(2)
+    ])
+
+    assert (shipping_ids, errors) == (["shipping_1", None], {1: "send failed"})
+
+
+def test_create_shipping_batch_writes_all_items():
+    """Ensure batch creation spans several batch_write_item chunks"""
+    repository = ShippingRepository()
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    shippings = [{
+        "shipping_type": ShippingService.list_available_shipping_type()[0],
+        "product_ids": [f"Product {i}"],
+        "order_id": f"order_{i}",
+        "status": ShippingService.SHIPPING_CREATED,
+        "due_date": due_date,
+    } for i in range(30)]
+
+    shipping_ids, errors = repository.create_shipping_batch(shippings)
+
+    assert errors == {}
+    assert len(shipping_ids) == 30
+    assert repository.get_shipping(shipping_ids[27])["order_id"] == "order_27"
+
+
+def test_buffered_publisher_sends_in_batches(mocker):
+    """Ensure the buffered publisher groups messages and resolves futures"""
+    with BufferedShippingPublisher(max_linger=60) as publisher:
+        spy = mocker.spy(publisher.client, "send_message_batch")
+        futures = [publisher.send_new_shipping(f"shipping_{i}") for i in range(12)]
+        assert spy.call_count == 1, "First 10 ids must be flushed on size"
+
+    assert spy.call_count == 2, "Remaining ids must be flushed on exit"
+    assert all(future.result(timeout=5) for future in futures)
+
+
+def test_process_shipping_batch_uses_batched_reads_and_writes(mocker):
+    """Ensure the batch path completes and fails shipments in grouped calls"""
+    repository = ShippingRepository()
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    now = datetime.now(timezone.utc)
+    on_time_id = repository.create_shipping(shipping_type, ["A"], "order_1",
+                                            ShippingService.SHIPPING_IN_PROGRESS, now + timedelta(days=1))
+    overdue_id = repository.create_shipping(shipping_type, ["B"], "order_2",
+                                            ShippingService.SHIPPING_IN_PROGRESS, now - timedelta(days=1))
+
+    mock_publisher = mocker.Mock()
+    mock_publisher.poll_shipping.return_value = [on_time_id, "missing", overdue_id]
+    shipping_service = ShippingService(repository, mock_publisher)
+    get_item = mocker.spy(repository.table, "get_item")
+
+    result = shipping_service.process_shipping_batch()
+
+    assert len(result) == 3
+    assert result[0]["HTTPStatusCode"] == 200
+    assert result[1] == {}
+    assert get_item.call_count == 0
+    assert shipping_service.check_status(on_time_id) == ShippingService.SHIPPING_COMPLETED
+    assert shipping_service.check_status(overdue_id) == ShippingService.SHIPPING_FAILED
+
+
+def test_outbox_creation_writes_once_and_relay_publishes(mocker):
+    """Ensure outbox mode persists the final state in one write and the relay publishes it"""
+    repository = ShippingRepository()
+    publisher = ShippingPublisher()
+    shipping_service = ShippingService(repository, publisher, use_outbox=True)
+    update_item = mocker.spy(repository.table, "update_item")
+    send_message = mocker.spy(publisher.client, "send_message")
+
+    shipping_id = shipping_service.create_shipping(
+        ShippingService.list_available_shipping_type()[0], ["Product"], str(uuid.uuid4()),
+        datetime.now(timezone.utc) + timedelta(days=1)
+    )
+
+    assert update_item.call_count == 0 and send_message.call_count == 0
+    assert shipping_service.check_status(shipping_id) == ShippingService.SHIPPING_IN_PROGRESS
+    assert repository.list_outbox()[shipping_id] is not None
+
+    send_batch = mocker.spy(publisher, "send_new_shipping_batch")
+    ShippingOutboxRelay(repository, publisher).relay_once()
+
+    assert shipping_id in send_batch.call_args.args[0]
+    assert shipping_id not in repository.list_outbox()
+
+
+@pytest.mark.offline
+def test_consumer_deletes_only_handled_messages(mocker):
+    """Ensure the consumer deletes handled messages and keeps failed ones"""
+    mock_service = mocker.Mock()
+    mock_service.process_shipping_batch.return_value = [{"HTTPStatusCode": 200}, None]
+    mock_publisher = mocker.Mock()
+    mock_publisher.delete_shippings.return_value = {}
+    messages = [{"Body": "shipping_1", "ReceiptHandle": "r1"}, {"Body": "shipping_2", "ReceiptHandle": "r2"}]
+
+    ShippingConsumer(mock_service, mock_publisher).handle(messages)
+
+    mock_service.process_shipping_batch.assert_called_once_with(["shipping_1", "shipping_2"], parents=[None, None])
+    mock_publisher.delete_shippings.assert_called_once_with(["r1"])
+
+
+@pytest.mark.offline
+def test_consumer_drains_prefetched_batch_on_stop(mocker):
+    """Ensure a stopped consumer still processes the batch it already received"""
+    mock_service = mocker.Mock()
+    mock_service.process_shipping_batch.return_value = [{}]
+    mock_publisher = mocker.Mock()
+    mock_publisher.delete_shippings.return_value = {}
+    consumer = ShippingConsumer(mock_service, mock_publisher)
+
+    def receive(*args, **kwargs):
+        consumer.stop()
+        return [{"Body": "shipping_1", "ReceiptHandle": "r1"}]
+
+    mock_publisher.receive_shippings.side_effect = receive
+    consumer.run()
+
+    assert mock_publisher.receive_shippings.call_count == 1
+    mock_publisher.delete_shippings.assert_called_once_with(["r1"])
+
+
+@pytest.mark.offline
+def test_consumer_survives_receive_errors_and_logs_failed_deletes(mocker, caplog):
+    """Ensure a failed receive does not stop the consumer and failed deletes are logged"""
+    mock_service = mocker.Mock()
+    mock_service.process_shipping_batch.return_value = [{}]
+    mock_publisher = mocker.Mock()
+    mock_publisher.delete_shippings.return_value = {0: "receipt handle expired"}
+    consumer = ShippingConsumer(mock_service, mock_publisher)
+
+    def receive(*args, **kwargs):
+        if mock_publisher.receive_shippings.call_count == 1:
+            raise ConnectionError("connection reset")
+        consumer.stop()
+        return [{"Body": "shipping_1", "ReceiptHandle": "r1"}]
+
+    mock_publisher.receive_shippings.side_effect = receive
+    consumer.run()
+
+    assert mock_publisher.receive_shippings.call_count == 2
+    mock_service.process_shipping_batch.assert_called_once_with(["shipping_1"], parents=[None])
+    assert "Failed to receive shippings" in caplog.text
+    assert "shipping_1" in caplog.text and "receipt handle expired" in caplog.text
+
+
+@pytest.mark.offline
+def test_consumer_extends_visibility_of_prefetched_batch(mocker):
+    """Ensure a batch received while the previous one is processed stays invisible until it is handled"""
+    mock_publisher = mocker.Mock()
+    mock_publisher.delete_shippings.return_value = {}
+    mock_service = mocker.Mock()
+    consumer = ShippingConsumer(mock_service, mock_publisher, visibility_timeout=0.1)
+    extended_before_processing = []
+
+    def receive(*args, **kwargs):
+        if mock_publisher.receive_shippings.call_count == 1:
+            return [{"Body": "shipping_1", "ReceiptHandle": "r1"}]
+        consumer.stop()
+        return [{"Body": "shipping_2", "ReceiptHandle": "r2"}]
+
+    def process(shipping_ids, parents):
+        if shipping_ids == ["shipping_1"]:
+            time.sleep(0.3)
+        else:
+            extended_before_processing.extend(call.args[0] for call in mock_publisher.extend_visibility.call_args_list)
+        return [{}]
+
+    mock_publisher.receive_shippings.side_effect = receive
+    mock_service.process_shipping_batch.side_effect = process
+    consumer.run()
+
+    assert ["r2"] in extended_before_processing
+    assert mock_publisher.delete_shippings.call_count == 2
+
+
+@pytest.mark.offline
+def test_process_shipping_batch_with_workers_keeps_order_and_times_out(mocker):
+    """Ensure the executor-backed batch path keeps result order and reports slow items"""
+    due_date = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    mock_repo = mocker.Mock()
+    mock_repo.get_shipping_batch.return_value = {
+        "fast": {"due_date": due_date}, "slow": {"due_date": due_date}
+    }
+
+    def update_shipping_status(shipping_id, status):
+        if shipping_id == "slow":
+            time.sleep(1)
+        return {"ResponseMetadata": {"shipping_id": shipping_id}}
+
+    mock_repo.update_shipping_status.side_effect = update_shipping_status
+    shipping_service = ShippingService(mock_repo, mocker.Mock(), max_workers=2, item_timeout=0.2)
+
+    result = shipping_service.process_shipping_batch(["slow", "missing", "fast"])
+
+    assert result == [None, {}, {"shipping_id": "fast"}]
+    mock_repo.update_shipping_status_batch.assert_not_called()
+
+
+@pytest.mark.offline
+def test_process_shipping_batch_times_out_each_item_from_its_own_start(mocker):
+    """Ensure a slow item is reported after its own item_timeout, not after the whole batch budget"""
+    due_date = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    mock_repo = mocker.Mock()
+    mock_repo.get_shipping_batch.return_value = {
+        shipping_id: {"due_date": due_date} for shipping_id in ["slow", "fast_1", "fast_2", "fast_3"]
+    }
+    release = threading.Event()
+
+    def update_shipping_status(shipping_id, status):
+        if shipping_id == "slow":
+            release.wait(5)
+        return {"ResponseMetadata": {"shipping_id": shipping_id}}
+
+    mock_repo.update_shipping_status.side_effect = update_shipping_status
+    with ShippingService(mock_repo, mocker.Mock(), max_workers=2, item_timeout=0.3) as shipping_service:
+        started = time.monotonic()
+        result = shipping_service.process_shipping_batch(["slow", "fast_1", "fast_2", "fast_3"])
+        elapsed = time.monotonic() - started
+        release.set()
+
+    assert result == [None, {"shipping_id": "fast_1"}, {"shipping_id": "fast_2"}, {"shipping_id": "fast_3"}]
+    assert elapsed < 0.55
+    assert shipping_service.executor._shutdown
+
+
+def test_async_service_creates_and_processes_concurrently():
+    """Ensure the asyncio service can fan out shipping creation and processing"""
+    async def scenario():
+        async with AsyncShippingRepository() as repository, AsyncShippingPublisher() as publisher:
+            shipping_service = AsyncShippingService(repository, publisher)
+            shipping_type = ShippingService.list_available_shipping_type()[0]
+            due_date = datetime.now(timezone.utc) + timedelta(days=1)
+
+            shipping_ids = await asyncio.gather(*(
+                shipping_service.create_shipping(shipping_type, ["Product"], str(uuid.uuid4()), due_date)
+                for _ in range(5)
+            ))
+            statuses = await asyncio.gather(*(shipping_service.check_status(shipping_id) for shipping_id in shipping_ids))
+            result = await shipping_service.process_shipping_batch(shipping_ids)
+            completed = await shipping_service.check_status(shipping_ids[0])
+            return statuses, result, completed
+
+    statuses, result, completed = asyncio.run(scenario())
+
+    assert statuses == [ShippingService.SHIPPING_IN_PROGRESS] * 5
+    assert all(metadata["HTTPStatusCode"] == 200 for metadata in result)
+    assert completed == ShippingService.SHIPPING_COMPLETED
+
+
+@pytest.mark.offline
+def test_async_service_is_not_a_sync_service():
+    """Ensure the asyncio service cannot be used where the synchronous one is expected"""
+    shipping_service = AsyncShippingService(AsyncShippingRepository(), AsyncShippingPublisher())
+
+    assert not isinstance(shipping_service, ShippingService)
+    assert not hasattr(shipping_service, "_update_statuses_concurrently")
+    with pytest.raises(TypeError):
+        Order(ShoppingCart(), shipping_service)
+
+
+def test_repositories_and_publishers_share_clients(mocker):
+    """Ensure AWS clients and the queue url are built once per process"""
+    create_queue = mocker.spy(ShippingPublisher().client, "create_queue")
+
+    first, second = ShippingPublisher(), ShippingPublisher()
+
+    assert first.client is second.client
+    assert first.queue_url == second.queue_url
+    assert create_queue.call_count == 0
+    assert ShippingRepository().table.meta.client is ShippingRepository().table.meta.client
+
+    repository = ShippingRepository()
+    tables = [repository.table]
+    worker = threading.Thread(target=lambda: tables.append(repository.table))
+    worker.start()
+    worker.join()
+    assert tables[0] is repository.table and tables[1] is not tables[0]
+    assert tables[1].meta.client is tables[0].meta.client
+
+
+@pytest.mark.offline
+def test_cached_repository_serves_status_reads_and_writes_through(mocker):
+    """Ensure check_status is served from the cache and status updates are written through"""
+    mock_repo = mocker.Mock()
+    mock_repo.get_shipping.return_value = {"shipping_id": "shipping_1", "shipping_status": "in progress"}
+    mock_repo.update_shipping_status.return_value = {"ResponseMetadata": {}}
+    repository = CachedShippingRepository(mock_repo)
+    shipping_service = ShippingService(repository, mocker.Mock())
+
+    assert shipping_service.check_status("shipping_1") == "in progress"
+    shipping_service.complete_shipping("shipping_1")
+    assert shipping_service.check_status("shipping_1") == ShippingService.SHIPPING_COMPLETED
+
+    assert mock_repo.get_shipping.call_count == 1
+    assert repository.cache.stats()["hit_rate"] == 0.5
+
+
+@pytest.mark.offline
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    """Ensure cache entries expire after their ttl and the LRU entry is evicted first"""
+    now = [0.0]
+    cache = TTLCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("c") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_repository_reads_only_requested_attributes():
+    """Ensure projected reads return only the requested attributes"""
+    repository = ShippingRepository()
+    shipping_id = repository.create_shipping(
+        ShippingService.list_available_shipping_type()[0], ["A", "B"], "order_1",
+        ShippingService.SHIPPING_IN_PROGRESS, datetime.now(timezone.utc) + timedelta(days=1)
+    )
+
+    shipping = repository.get_shipping(shipping_id, attributes=["shipping_status"], consistent=True)
+    batch = repository.get_shipping_batch([shipping_id], attributes=["due_date"])
+
+    assert shipping == {"shipping_status": ShippingService.SHIPPING_IN_PROGRESS}
+    assert set(batch[shipping_id]) == {"shipping_id", "due_date"}
+
+
+@pytest.mark.offline
+def test_inventory_products_keep_product_semantics():
+    """Ensure inventory views can be bought through a cart and update the columns"""
+    inventory = Inventory([Product(name="Laptop", price=1500, available_amount=5)])
+    inventory.add_product("Mouse", 50, 10)
+
+    cart = ShoppingCart()
+    cart.add_product(inventory["Mouse"], amount=4)
+    cart.submit_cart_order()
+
+    assert inventory["Mouse"].available_amount == 6
+    assert inventory.is_available("Laptop", 5) and not inventory.is_available("Mouse", 7)
+    assert inventory["Laptop"] == "Laptop" and "Keyboard" not in inventory
+    assert inventory.memory_footprint() > 0
+    assert not hasattr(inventory["Mouse"], "__dict__")
+
+
+@pytest.mark.offline
+def test_submit_cart_order_is_all_or_nothing():
+    """Ensure a cart that cannot be fully served leaves every product untouched"""
+    keyboard = Product(available_amount=10, name="Keyboard", price=100)
+    mouse = Product(available_amount=1, name="Mouse", price=50)
+    cart = ShoppingCart()
+    cart.add_product(keyboard, amount=2)
+    cart.add_product(mouse, amount=1)
+    mouse.buy(1)
+
+    with pytest.raises(ValueError, match="Not enough stock available"):
+        cart.submit_cart_order()
+
+    assert keyboard.available_amount == 10
+
+
+@pytest.mark.offline
+def test_concurrent_checkouts_never_oversell():
+    """Ensure concurrent checkouts of a hot product sell exactly the available stock"""
+    product = Product(available_amount=50, name="Hot product", price=10)
+    sold = []
+
+    def checkout():
+        cart = ShoppingCart()
+        try:
+            cart.add_product(product, amount=1)
+            sold.extend(cart.submit_cart_order())
+        except ValueError:
+            pass
+
+    threads = [threading.Thread(target=checkout) for _ in range(120)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(sold) == 50
+    assert product.available_amount == 0
+
+
+@pytest.mark.offline
+def test_expired_reservations_are_released():
+    """Ensure stock held by an expired reservation is given back"""
+    product = Product(available_amount=5, name="Camera", price=700)
+    reservations = StockReservations(ttl=30)
+    reservation = reservations.reserve({product: 3})
+
+    assert product.available_amount == 2
+    assert reservations.release_expired(now=reservation.expires_at) == 1
+    assert product.available_amount == 5
+    with pytest.raises(ValueError):
+        reservation.commit()
+
+
+@pytest.mark.offline
+def test_sharded_product_sells_exact_stock_concurrently():
+    """Ensure a sharded hot product sells exactly its stock across threads"""
+    product = ShardedProduct(name="Flash sale", price=10, available_amount=100, shards=8)
+    sold = []
+
+    def buy():
+        for _ in range(20):
+            if product.take(1):
+                sold.append(1)
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(sold) == 100
+    assert product.available_amount == 0
+
+
+def test_dynamo_sharded_stock_takes_across_shards():
+    """Ensure the DynamoDB sharded counter serves requests larger than one shard"""
+    stock = DynamoShardedStock(str(uuid.uuid4()), shards=4)
+    stock.reset(10)
+    product = ShardedProduct(name="Flash sale", price=10, stock=stock)
+
+    product.buy(4)
+
+    assert product.available_amount == 6
+    assert sorted(stock.read_shards().values()) == [1, 1, 2, 2]
+    assert not product.take(7)
+
+
+@pytest.mark.offline
+def test_cart_total_is_exact_and_incremental():
+    """Ensure cart totals use exact decimal arithmetic and follow every mutation"""
+    cart = ShoppingCart()
+    cart.add_product(Product(available_amount=10, name="Pen", price=0.1), amount=3)
+    cart.add_product(Product(available_amount=10, name="Paper", price=0.2), amount=1)
+    cart.add_product(Product(available_amount=10, name="Pen", price=0.1), amount=1)
+
+    assert cart.get_total_price() == Decimal("0.3")
+    assert cart.item_count == 2
+    assert cart.get_product("Paper").price == 0.2
+
+    cart.remove_product("Paper")
+
+    assert cart.get_total_price() == Decimal("0.1")
+    assert len(cart.products) == 1
+
+
+@pytest.mark.offline
+def test_price_carts_matches_cart_totals_and_applies_overrides():
+    """Ensure batch pricing matches per-cart totals and applies price overrides in bulk"""
+    keyboard = Product(available_amount=100, name="Keyboard", price=19.99)
+    mouse = Product(available_amount=100, name="Mouse", price=5.25)
+    carts = [ShoppingCart(), ShoppingCart(), ShoppingCart()]
+    carts[0].add_product(keyboard, amount=2)
+    carts[0].add_product(mouse, amount=3)
+    carts[2].add_product(mouse, amount=1)
+
+    assert price_carts(carts) == [cart.get_total_price() for cart in carts]
+    assert price_carts(carts, overrides={"Mouse": 5}) == [Decimal("54.98"), Decimal(0), Decimal(5)]
+
+
+@pytest.mark.offline
+def test_price_carts_rejects_sub_cent_prices():
+    """Ensure batch pricing refuses prices it could only round, instead of drifting from cart totals"""
+    cart = ShoppingCart()
+    cart.add_product(Product(available_amount=10, name="Screw", price=0.565), amount=2)
+    cart.add_product(Product(available_amount=10, name="Nut", price=0.005), amount=1)
+    whole = ShoppingCart()
+    whole.add_product(Product(available_amount=10, name="Bolt", price=1.12), amount=1)
+
+    assert cart.get_total_price() == Decimal("1.135")
+    with pytest.raises(ValueError):
+        price_carts([cart])
+    with pytest.raises(ValueError):
+        price_carts([whole], overrides={"Bolt": 1.125})
+    assert price_carts([whole]) == [whole.get_total_price()]
+
+
+def test_place_orders_reports_each_order_and_rolls_back_stock():
+    """Ensure bulk order placement reports per-order results and restores stock of failed orders"""
+    products = [Product(available_amount=5, name=f"Product {i}", price=10) for i in range(3)]
+    orders = []
+    shipping_service = ShippingService(ShippingRepository(), ShippingPublisher())
+    for product, amount in zip(products, [1, 2, 3]):
+        cart = ShoppingCart()
+        cart.add_product(product, amount=amount)
+        orders.append(Order(cart, shipping_service))
+    orders.append(Order(ShoppingCart(), shipping_service))
+    products[2].buy(4)
+
+    shipping_ids, errors = place_orders(orders, ShippingService.list_available_shipping_type()[0],
+                                        due_date=datetime.now(timezone.utc) + timedelta(days=1))
+
+    assert shipping_ids[0] and shipping_ids[1] and shipping_ids[2] is None and shipping_ids[3] is None
+    assert errors == {2: "Not enough stock available", 3: "Cart is empty"}
+    assert [product.available_amount for product in products] == [4, 3, 1]
+    assert shipping_service.check_status(shipping_ids[1]) == ShippingService.SHIPPING_IN_PROGRESS
+    assert not orders[0].cart.products
+
+
+@pytest.mark.offline
+def test_place_orders_releases_stock_when_shipping_fails(mocker):
+    """Ensure stock reserved for an order is returned when its shipment cannot be created"""
+    product = Product(available_amount=5, name="Product", price=10)
+    cart = ShoppingCart()
+    cart.add_product(product, amount=2)
+    shipping_service = ShippingService(mocker.Mock(), mocker.Mock())
+    mocker.patch.object(shipping_service, "create_shippings", return_value=([None], {0: "write failed"}))
+
+    _, errors = place_orders([Order(cart, shipping_service)], ShippingService.list_available_shipping_type()[0])
+
+    assert errors == {0: "write failed"}
+    assert product.available_amount == 5
+    assert cart.products
+
+
+@pytest.mark.offline
+def test_place_orders_releases_stock_when_shipping_batch_raises(mocker):
+    """Ensure a batch whose shipment creation raises gets all of its reserved stock back"""
+    product = Product(available_amount=5, name="Product", price=10)
+    carts = [ShoppingCart(), ShoppingCart()]
+    for cart in carts:
+        cart.add_product(product, amount=1)
+    mock_repo = mocker.Mock()
+    mock_repo.create_shipping_batch.side_effect = ConnectionError("connection reset")
+    shipping_service = ShippingService(mock_repo, mocker.Mock())
+
+    shipping_ids, errors = place_orders([Order(cart, shipping_service) for cart in carts],
+                                        ShippingService.list_available_shipping_type()[0])
+
+    assert shipping_ids == [None, None]
+    assert errors == {0: "connection reset", 1: "connection reset"}
+    assert product.available_amount == 5
+    assert all(cart.products for cart in carts)
+
+
+@pytest.mark.offline
+def test_place_orders_keeps_published_orders_and_fails_unpublished_shippings(mocker):
+    """Ensure a status update failing after publish is not rolled back, and unsent shippings are marked failed"""
+    products = [Product(available_amount=5, name=f"Product {i}", price=10) for i in range(2)]
+    orders = []
+    mock_repo = mocker.Mock()
+    mock_repo.create_shipping_batch.return_value = (["shipping_1", "shipping_2"], {})
+    mock_repo.update_shipping_status_batch.return_value = ({}, {"shipping_1": "conflict"})
+    mock_publisher = mocker.Mock()
+    mock_publisher.send_new_shipping_batch.return_value = (["message_1", None], {1: "send failed"})
+    shipping_service = ShippingService(mock_repo, mock_publisher)
+    for product in products:
+        cart = ShoppingCart()
+        cart.add_product(product, amount=2)
+        orders.append(Order(cart, shipping_service))
+
+    shipping_ids, errors = place_orders(orders, ShippingService.list_available_shipping_type()[0])
+
+    assert errors == {1: "send failed"}
+    assert shipping_ids == ["shipping_1", None]
+    assert [product.available_amount for product in products] == [3, 5]
+    mock_repo.update_shipping_status_batch.assert_called_once_with({
+        "shipping_1": ShippingService.SHIPPING_IN_PROGRESS, "shipping_2": ShippingService.SHIPPING_FAILED
+    })
+
+
+@pytest.mark.offline
+def test_place_orders_keeps_published_orders_when_status_update_raises(mocker):
+    """Ensure a connection error after the messages were sent does not give the stock back"""
+    product = Product(available_amount=5, name="Product", price=10)
+    mock_repo = mocker.Mock()
+    mock_repo.create_shipping_batch.return_value = (["shipping_1"], {})
+    mock_repo.update_shipping_status_batch.side_effect = EndpointConnectionError(endpoint_url="http://127.0.0.1:1")
+    mock_publisher = mocker.Mock()
+    mock_publisher.send_new_shipping_batch.return_value = (["message_1"], {})
+    cart = ShoppingCart()
+    cart.add_product(product, amount=2)
+
+    shipping_ids, errors = place_orders([Order(cart, ShippingService(mock_repo, mock_publisher))],
+                                        ShippingService.list_available_shipping_type()[0])
+
+    assert (shipping_ids, errors) == (["shipping_1"], {})
+    assert product.available_amount == 3
+
+
+def test_sweeper_fails_only_expired_in_progress_shippings():
+    """Ensure the expiry sweeper fails overdue in-progress shippings found through the due-date index"""
+    repository = ShippingRepository()
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    now = datetime.now(timezone.utc)
+    overdue_id = repository.create_shipping(shipping_type, ["A"], "order_1",
+                                            ShippingService.SHIPPING_IN_PROGRESS, now - timedelta(minutes=1))
+    completed_id = repository.create_shipping(shipping_type, ["B"], "order_2",
+                                              ShippingService.SHIPPING_IN_PROGRESS, now - timedelta(minutes=1))
+    future_id = repository.create_shipping(shipping_type, ["C"], "order_3",
+                                           ShippingService.SHIPPING_IN_PROGRESS, now + timedelta(seconds=30))
+
+    sweeper = ShippingExpirySweeper(repository, horizon=60)
+    sweeper.load(now)
+    repository.update_shipping_status(completed_id, ShippingService.SHIPPING_COMPLETED)
+    failed = sweeper.sweep(now)
+
+    assert overdue_id in failed and completed_id not in failed and future_id not in failed
+    assert repository.get_shipping(overdue_id)["shipping_status"] == ShippingService.SHIPPING_FAILED
+    assert repository.get_shipping(completed_id)["shipping_status"] == ShippingService.SHIPPING_COMPLETED
+    assert sweeper.next_due() is not None
+
+
+def test_conditional_status_batch_works_through_cache_and_async_repository():
+    """Ensure the sweeper's conditional batch update is supported by the cached and the async repositories"""
+    repository = CachedShippingRepository(ShippingRepository())
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    now = datetime.now(timezone.utc)
+    overdue_id = repository.create_shipping(shipping_type, ["A"], "order_1",
+                                            ShippingService.SHIPPING_IN_PROGRESS, now - timedelta(minutes=1))
+    repository.get_shipping(overdue_id)
+
+    sweeper = ShippingExpirySweeper(repository)
+    sweeper.track(overdue_id, now - timedelta(minutes=1))
+
+    assert sweeper.sweep(now) == [overdue_id]
+    assert repository.get_shipping(overdue_id)["shipping_status"] == ShippingService.SHIPPING_FAILED
+
+    async def scenario():
+        async with AsyncShippingRepository() as async_repository:
+            return await async_repository.update_shipping_status_batch(
+                {overdue_id: ShippingService.SHIPPING_COMPLETED}, expected_status=ShippingService.SHIPPING_IN_PROGRESS
+            )
+
+    responses, errors = asyncio.run(scenario())
+
+    assert not responses and overdue_id in errors
+    assert ShippingRepository().get_shipping(overdue_id)["shipping_status"] == ShippingService.SHIPPING_FAILED
+
+
+def test_list_shippings_by_order_pages_lazily(mocker):
+    """Ensure shippings of an order are streamed page by page from the order index"""
+    repository = ShippingRepository()
+    order_id = str(uuid.uuid4())
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    shipping_ids = {
+        repository.create_shipping(shipping_type, [f"Product {i}"], order_id, ShippingService.SHIPPING_CREATED, due_date)
+        for i in range(5)
+    }
+    query = mocker.spy(repository.table, "query")
+
+    shippings = repository.list_shippings_by_order(order_id, page_size=2)
+    first = next(shippings)
+
+    assert query.call_count == 1
+    assert {first["shipping_id"], *(shipping["shipping_id"] for shipping in shippings)} == shipping_ids
+    assert query.call_count == 3
+
+
+def test_exporter_resumes_interrupted_segments_without_duplicates(tmp_path, mocker):
+    """Ensure a parallel export resumes from its checkpoints and writes every shipping once"""
+    repository = ShippingRepository()
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    shipping_ids, _ = repository.create_shipping_batch([
+        dict(shipping_type=shipping_type, product_ids=["Product"], order_id=str(uuid.uuid4()),
+             status=ShippingService.SHIPPING_CREATED, due_date=due_date)
+        for _ in range(12)
+    ])
+    scan_segment = repository.scan_segment
+
+    def crash_after_first_page(segment, *args, **kwargs):
+        pages = scan_segment(segment, *args, **kwargs)
+        yield next(pages)
+        if segment == 0:
+            raise RuntimeError("connection lost")
+        yield from pages
+
+    exporter = ShippingExporter(repository, str(tmp_path), segments=3, compress=True, page_size=2)
+    mocker.patch.object(repository, "scan_segment", side_effect=crash_after_first_page)
+    with pytest.raises(RuntimeError):
+        exporter.export()
+    mocker.stopall()
+    with gzip.open(exporter.part_path(0), "ab") as part:
+        part.write(b'{"shipping_id": "written after the last checkpoint"}\n')
+
+    counts = exporter.export()
+
+    exported = []
+    for path in counts:
+        with gzip.open(path, "rt") as part:
+            exported.extend(json.loads(line)["shipping_id"] for line in part)
+    assert len(exported) == len(set(exported)) == sum(counts.values())
+    assert set(shipping_ids) <= set(exported)
+
+
+def test_product_ids_are_encoded_compactly_and_legacy_items_still_decode(dynamo_resource, mocker):
+    """Ensure product ids round-trip as a list, compressed, chunked and from the legacy comma string"""
+    mocker.patch("services.encoding.PRODUCT_IDS_LIST_MAX_BYTES", 64)
+    mocker.patch("services.encoding.PRODUCT_IDS_CHUNK_BYTES", 1024)
+    repository = ShippingRepository()
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    orders = {
+        "small": ["Socks, wool", "Hat"],
+        "compressed": ["Product"] * 100,
+        "chunked": [str(uuid.uuid4()) for _ in range(200)],
+    }
+    shipping_ids, errors = repository.create_shipping_batch([
+        dict(shipping_type=shipping_type, product_ids=product_ids, order_id=str(uuid.uuid4()),
+             status=ShippingService.SHIPPING_CREATED, due_date=due_date)
+        for product_ids in orders.values()
+    ])
+    legacy_id = str(uuid.uuid4())
+    dynamo_resource.Table(SHIPPING_TABLE_NAME).put_item(Item={"shipping_id": legacy_id, "product_ids": "A,B"})
+
+    shippings = repository.get_shipping_batch([*shipping_ids, legacy_id])
+    stored = repository.table.get_item(Key={"shipping_id": shipping_ids[2]})["Item"]
+
+    assert errors == {}
+    assert [shippings[shipping_id]["product_ids"] for shipping_id in shipping_ids] == list(orders.values())
+    assert shippings[legacy_id]["product_ids"] == ["A", "B"]
+    assert repository.get_shipping(shipping_ids[2], attributes=["product_ids"])["product_ids"] == orders["chunked"]
+    assert "product_ids" not in stored and stored["product_ids_chunks"] > 1
+
+
+@pytest.mark.offline
+def test_memory_backend_runs_the_shipping_flow_without_aws():
+    """Ensure the in-memory repository and publisher carry shippings from creation to completion"""
+    publisher = MemoryShippingPublisher(MemoryQueue())
+    service = ShippingService(MemoryShippingRepository(MemoryTable()), publisher)
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+
+    shipping_ids, errors = service.create_shippings([
+        {"shipping_type": shipping_type, "product_ids": [f"Product {i}"], "order_id": "order", "due_date": due_date}
+        for i in range(12)
+    ])
+    results = ShippingConsumer(service, publisher, batch_size=10, wait_time=0).handle(
+        publisher.receive_shippings(10, wait_time=0) + publisher.receive_shippings(10, wait_time=0)
+    )
+
+    assert errors == {} and len(results) == 12 and None not in results
+    assert {service.check_status(shipping_id) for shipping_id in shipping_ids} == {ShippingService.SHIPPING_COMPLETED}
+    assert sorted(shipping["shipping_id"] for shipping in service.repository.list_shippings_by_order("order")) == \
+        sorted(shipping_ids)
+    assert len(publisher.queue) == 0
+
+
+@pytest.mark.offline
+def test_memory_table_pages_without_rescanning_the_table():
+    """Ensure paging through the memory table filters and sorts the items once per scan"""
+    table = MemoryTable()
+    table.batch_write_item([{"shipping_id": f"shipping_{index:03}", "even": index % 2 == 0} for index in range(100)])
+    checked = []
+
+    def is_even(item):
+        checked.append(item["shipping_id"])
+        return item["even"]
+
+    pages = list(table.scan_pages(is_even, limit=10))
+    resumed, _ = table.scan(is_even, start_after=pages[2][1], limit=10)
+
+    assert [len(items) for items, _ in pages] == [10] * 5
+    assert pages[-1][1] is None and resumed == pages[3][0]
+    assert [item["shipping_id"] for items, _ in pages for item in items] == \
+        [f"shipping_{index:03}" for index in range(0, 100, 2)]
+    assert len(checked) == 100 + 50 + 100 + 10
+
+
+@pytest.mark.offline
+def test_memory_queue_redelivers_after_visibility_timeout():
+    """Ensure an undeleted message becomes visible again once its visibility timeout passes"""
+    now = [0.0]
+    publisher = MemoryShippingPublisher(MemoryQueue(visibility_timeout=30, clock=lambda: now[0]))
+    publisher.send_new_shipping("shipping")
+
+    first = publisher.receive_shippings(wait_time=0)
+    hidden = publisher.receive_shippings(wait_time=0)
+    now[0] = 31
+    second = publisher.receive_shippings(wait_time=0)
+
+    assert [message["Body"] for message in first + second] == ["shipping", "shipping"]
+    assert hidden == []
+    assert publisher.delete_shippings([first[0]["ReceiptHandle"]]) == {0: ANY}
+    assert publisher.delete_shippings([second[0]["ReceiptHandle"]]) == {}
+
+
+@pytest.mark.offline
+def test_benchmark_comparison_flags_only_regressions():
+    """Ensure a benchmark run fails the baseline comparison only for regressed benchmarks"""
+    results = [
+        measure("fast", lambda: None, iterations=50),
+        measure("slow", lambda: time.sleep(0.002), iterations=5),
+    ]
+    baseline = {"results": {
+        "fast": {**results[0], "p50_ms": results[0]["p50_ms"] * 10, "p95_ms": results[0]["p95_ms"] * 10},
+        "slow": {**results[1], "p50_ms": 0.5, "p95_ms": 0.5, "ops_per_second": 2000},
+    }}
+
+    regressions = compare(results, baseline, tolerance=0.2)
+
+    assert results[1]["p50_ms"] >= 2 and results[1]["p50_ms"] <= results[1]["p95_ms"] <= results[1]["p99_ms"]
+    assert len(regressions) == 3 and all(regression.startswith("slow:") for regression in regressions)
+
+
+def test_metrics_record_repository_and_publisher_calls():
+    """Ensure AWS calls are counted with errors, capacity and latency and rendered for Prometheus"""
+    REGISTRY.reset()
+    repository = ShippingRepository()
+    publisher = ShippingPublisher()
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+
+    shipping_id = repository.create_shipping(shipping_type, ["Product"], "order", ShippingService.SHIPPING_CREATED, due_date)
+    repository.get_shipping(shipping_id)
+    repository.update_shipping_status_batch({shipping_id: ShippingService.SHIPPING_FAILED}, expected_status="unknown")
+    publisher.send_new_shipping_batch([shipping_id])
+
+    snapshot = REGISTRY.snapshot()
+    prometheus = REGISTRY.to_prometheus()
+
+    assert snapshot["dynamodb.PutItem"]["calls"] == 1 and snapshot["dynamodb.GetItem"]["calls"] == 1
+    assert snapshot["dynamodb.PutItem"]["consumed_capacity"] > 0
+    assert snapshot["dynamodb.TransactWriteItems"]["errors"] == {"TransactionCanceledException": 1}
+    assert snapshot["sqs.SendMessageBatch"]["latency_seconds"]["count"] == 1
+    assert 'aws_client_calls_total{service="dynamodb",operation="GetItem"} 1' in prometheus
+    assert 'aws_client_latency_seconds_bucket{service="sqs",operation="SendMessageBatch",le="+Inf"} 1' in prometheus
+    assert json.loads(REGISTRY.to_json())["operations"] == snapshot
+
+
+@pytest.mark.offline
+def test_span_exporter_writes_from_one_open_file_until_closed(tmp_path, mocker):
+    """Ensure spans are written through a single file handle and flushed on close"""
+    path = str(tmp_path / "spans.jsonl")
+    exporter = JsonlSpanExporter(path)
+    opened = mocker.spy(builtins, "open")
+    for index in range(100):
+        span = Span(f"span-{index}")
+        span.end = span.start
+        exporter.export(span)
+    exporter.close()
+
+    assert [call.args[0] for call in opened.call_args_list].count(path) == 1
+    assert [span["name"] for span in read_spans(path)] == [f"span-{index}" for index in range(100)]
+
+    exporter.export(span)
+    exporter.close()
+    assert len(read_spans(path)) == 101
+
+
+@pytest.mark.offline
+def test_trace_follows_order_through_queue_to_consumer(tmp_path):
+    """Ensure the order's trace is resumed by the consumer with queue dwell and fulfilment latency"""
+    previous = set_exporter(JsonlSpanExporter(str(tmp_path / "spans.jsonl")))
+    try:
+        publisher = MemoryShippingPublisher(MemoryQueue())
+        service = ShippingService(MemoryShippingRepository(MemoryTable()), publisher)
+        cart = ShoppingCart()
+        cart.add_product(Product("Traced product", 10, 5), 1)
+        order = Order(cart, service)
+
+        shipping_id = order.place_order(ShippingService.list_available_shipping_type()[0],
+                                        datetime.now(timezone.utc) + timedelta(days=1))
+        ShippingConsumer(service, publisher, wait_time=0).handle(publisher.receive_shippings(wait_time=0))
+    finally:
+        set_exporter(previous).close()
+
+    spans = {span["name"]: span for span in read_spans(str(tmp_path / "spans.jsonl"))}
+    latencies = shipment_latencies(list(spans.values()))
+
+    assert {span["trace_id"] for span in spans.values()} == {spans["order.place_order"]["trace_id"]}
+    assert spans["shipping.create"]["parent_id"] == spans["order.place_order"]["span_id"]
+    assert spans["shipping.queue"]["parent_id"] == spans["shipping.create"]["span_id"]
+    assert spans["shipping.process"]["attributes"]["shipping_status"] == ShippingService.SHIPPING_COMPLETED
+    assert latencies[shipping_id]["queue_dwell_seconds"] >= 0
+    assert latencies[shipping_id]["order_to_fulfilment_seconds"] > 0
+
+
+@pytest.mark.offline
+def test_trace_follows_order_through_outbox_relay(tmp_path):
+    """Ensure a shipping written to the outbox is relayed with the trace context of its order"""
+    previous = set_exporter(JsonlSpanExporter(str(tmp_path / "spans.jsonl")))
+    try:
+        repository = MemoryShippingRepository(MemoryTable())
+        publisher = MemoryShippingPublisher(MemoryQueue())
+        service = ShippingService(repository, publisher, use_outbox=True)
+        cart = ShoppingCart()
+        cart.add_product(Product("Traced product", 10, 5), 1)
+
+        shipping_id = Order(cart, service).place_order(ShippingService.list_available_shipping_type()[0],
+                                                       datetime.now(timezone.utc) + timedelta(days=1))
+        ShippingOutboxRelay(repository, publisher).relay_once()
+        ShippingConsumer(service, publisher, wait_time=0).handle(publisher.receive_shippings(wait_time=0))
+    finally:
+        set_exporter(previous).close()
+
+    spans = {span["name"]: span for span in read_spans(str(tmp_path / "spans.jsonl"))}
+
+    assert {span["trace_id"] for span in spans.values()} == {spans["order.place_order"]["trace_id"]}
+    assert spans["shipping.queue"]["parent_id"] == spans["shipping.create"]["span_id"]
+    assert shipment_latencies(list(spans.values()))[shipping_id]["order_to_fulfilment_seconds"] > 0
+
+
+@pytest.mark.offline
+def test_adaptive_rate_limiter_backs_off_on_throttles_and_recovers():
+    """Ensure the token bucket queues callers past its burst and adapts its rate to throttling"""
+    now = [0.0]
+    limiter = AdaptiveRateLimiter(rate=10, burst=2, min_rate=1, max_rate=20, increase=10, clock=lambda: now[0])
+
+    delays = [limiter.reserve() for _ in range(3)]
+    limiter.on_throttle()
+    limiter.on_throttle()
+    throttled_rate = limiter.rate
+    now[0] = 1.0
+    for _ in range(5):
+        limiter.on_success()
+
+    assert delays == [0.0, 0.0, pytest.approx(0.1)]
+    assert throttled_rate == 5 and limiter.throttles == 2
+    assert 5 < limiter.rate <= 20
+
+
+@pytest.mark.offline
+def test_rate_limiting_hooks_count_throttles_and_unprocessed_batches(mocker):
+    """Ensure throttling errors and unprocessed batch items slow the shared limiter and are reported"""
+    mocker.patch.dict("services.retry._limiters", clear=True)
+    REGISTRY.reset()
+    events = HierarchicalEmitter()
+    install_rate_limiting(events)
+    ok, throttled = mocker.Mock(status_code=200), mocker.Mock(status_code=400)
+
+    events.emit("before-send.dynamodb.BatchWriteItem", request=None)
+    events.emit("needs-retry.dynamodb.BatchWriteItem", response=(ok, {"UnprocessedItems": {"Table": [{}]}}))
+    events.emit("needs-retry.sqs.SendMessage", response=(throttled, {"Error": {"Code": "RequestThrottled"}}))
+    events.emit("needs-retry.sqs.SendMessage", response=(ok, {}))
+
+    snapshot = REGISTRY.snapshot()
+    assert snapshot["dynamodb.BatchWriteItem"]["throttles"] == 1 and snapshot["sqs.SendMessage"]["throttles"] == 1
+    assert get_limiter("dynamodb").rate == RATE_LIMIT_INITIAL_RPS / 2
+    assert REGISTRY.gauges()["rate_limit_rps.sqs"] > RATE_LIMIT_INITIAL_RPS / 2
+    assert 'aws_client_throttles_total{service="dynamodb",operation="BatchWriteItem"} 1' in REGISTRY.to_prometheus()